@@ -1,80 +1,89 @@
 from fastapi import HTTPException, Depends, Security
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import supabase
+import hashlib
+import time
+from cachetools import TTLCache
+from jose import jwt, JWTError
+from .config import settings
 from .db import supabase
 
 
 
 bearer = HTTPBearer(scheme_name="BearerAuth")  # biar namanya match
-def ensure_profile(user: dict):
-    """
-    Ensure profiles row exists for authenticated user.
-    Safe to call multiple times.
-    """
-    user_id = user["user_id"]
-    email = user.get("email")
 
-    res = (
-        supabase.table("profiles")
-        .select("user_id")
-        .eq("user_id", user_id)
-        .maybe_single()
-        .execute()
-    )
+# blake2b(token) -> {"user_id", "email", "exp"}; entries also expire with the JWT itself
+_token_cache: TTLCache = TTLCache(maxsize=10_000, ttl=300)
 
-    if res.data:
-        return
 
-    supabase.table("profiles").insert({
-        "user_id": user_id,
-        "email": email,
-        # role, level, preferred_language handled by DB defaults
-    }).execute()
+def _token_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
 
 
-async def get_current_user(
-    creds: HTTPAuthorizationCredentials = Security(bearer),
-):
-    token = creds.credentials
+async def _verify_token(token: str) -> dict:
+    """
+    Resolve a bearer token to its auth user.
+    HS256 tokens are checked locally with SUPABASE_JWT_SECRET; only tokens signed
+    with another algorithm (asymmetric project keys) go to supabase.auth.get_user.
+    """
+    key = _token_key(token)
+    claims = _token_cache.get(key)
+    if claims and claims["exp"] > time.time():
+        return claims
+
+    try:
+        alg = jwt.get_unverified_header(token).get("alg")
+    except JWTError:
+        raise HTTPException(401, "Invalid token")
 
-    # 1. verify auth user
-    res = supabase.auth.get_user(token)
-    if not res or not res.user:
+    if alg == "HS256":
+        try:
+            payload = jwt.decode(
+                token,
+                settings.SUPABASE_JWT_SECRET,
+                algorithms=["HS256"],
+                audience="authenticated",
+                # jose only checks aud/exp/sub when present: a signed token
+                # without them (e.g. the anon key) must not pass as a user
+                options={"require_aud": True, "require_exp": True, "require_sub": True},
+            )
+        except JWTError:
+            raise HTTPException(401, "Invalid token")
+    else:
+        try:
+            res = await supabase.auth.get_user(token)
+        except Exception:
+            res = None
+        if not res or not res.user:
+            raise HTTPException(401, "Invalid token")
+        payload = jwt.get_unverified_claims(token)
+        payload["sub"] = res.user.id
+        payload["email"] = res.user.email
+
+    try:
+        claims = {
+            "user_id": payload["sub"],
+            "email": payload.get("email"),
+            "exp": payload.get("exp") or time.time() + 300,
+        }
+    except KeyError:
         raise HTTPException(401, "Invalid token")
+    _token_cache[key] = claims
+    return claims
 
-    user_id = res.user.id
-    email = res.user.email
 
-    # 2. fetch profile
-    resp = (
-        supabase.table("profiles")
-        .select("*")
-        .eq("user_id", user_id)
-        .limit(1)
-        .execute()
-    )
+async def get_current_user(
+    creds: HTTPAuthorizationCredentials = Security(bearer),
+):
+    token = creds.credentials
 
-    rows = resp.data or []
-    prof = rows[0] if rows else None
+    # 1. verify auth user (local HMAC check, cached per token)
+    claims = await _verify_token(token)
+    user_id = claims["user_id"]
+    email = claims["email"]
 
-    # 3. create profile if missing
-    if not prof:
-        supabase.table("profiles").insert({
-            "user_id": user_id,
-            "email": email,
-            "role": "student",
-            "level": "autre",
-            "preferred_language": "fr",
-        }).execute()
-
-        resp2 = (
-            supabase.table("profiles")
-            .select("*")
-            .eq("user_id", user_id)
-            .limit(1)
-            .execute()
-        )
-        prof = (resp2.data or [None])[0]
+    # 2. fetch-or-create profile in one round-trip (see ensure_profile RPC)
+    resp = await supabase.rpc("ensure_profile", {"uid": user_id, "em": email}).execute()
+    prof = resp.data
 
     if not prof:
         raise HTTPException(500, "Profile creation failed")
@@ -82,7 +91,7 @@ async def get_current_user(
     return prof
 
 
-def require_admin(user: dict = Depends(get_current_user)) -> dict:
+async def require_admin(user: dict = Depends(get_current_user)) -> dict:
     if user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
     return user
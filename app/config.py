@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -9,11 +10,17 @@ class Settings(BaseSettings):
     SUPABASE_URL: str
     SUPABASE_SERVICE_ROLE_KEY: str
     SUPABASE_JWT_SECRET: str
+    # PostgREST keep-alive pool (per app process)
+    SUPABASE_HTTP_MAX_CONNECTIONS: int = 64
+    SUPABASE_HTTP_MAX_KEEPALIVE: int = 32
+    SUPABASE_HTTP_KEEPALIVE_EXPIRY: float = 60.0
 
     GEMINI_API_KEY: str
     GEMINI_MODEL_CHAT: str = "gemini-2.0-flash"
     GEMINI_MODEL_EVAL: str = "gemini-2.0-flash"
 
     HISTORY_TURNS: int = 30
+    # processes rendering cohort summary PDFs (None = one per CPU)
+    PDF_WORKERS: Optional[int] = None
 
 settings = Settings()
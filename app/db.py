@@ -1,4 +1,66 @@
-from supabase import create_client, Client
+from typing import Dict, Optional, Union
+import httpx
+from postgrest import AsyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_TIMEOUT
+from supabase import AsyncClient
 from .config import settings
 
-supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
+_POOL_LIMITS = httpx.Limits(
+    max_connections=settings.SUPABASE_HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.SUPABASE_HTTP_MAX_KEEPALIVE,
+    keepalive_expiry=settings.SUPABASE_HTTP_KEEPALIVE_EXPIRY,
+)
+
+
+class _PooledPostgrestClient(AsyncPostgrestClient):
+    """PostgREST client whose httpx session uses explicit keep-alive pool limits."""
+
+    def create_session(
+        self,
+        base_url: str,
+        headers: Dict[str, str],
+        timeout: Union[int, float, httpx.Timeout],
+        verify: bool = True,
+        proxy: Optional[str] = None,
+    ) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            verify=verify,
+            proxy=proxy,
+            follow_redirects=True,
+            http2=True,
+            limits=_POOL_LIMITS,
+        )
+
+
+class _Client(AsyncClient):
+    # supabase-py 2.10 has no option to pass an httpx client, so swap the factory
+    # (also used when the client rebuilds PostgREST after an auth event)
+    @staticmethod
+    def _init_postgrest_client(
+        rest_url: str,
+        headers: Dict[str, str],
+        schema: str,
+        timeout: Union[int, float, httpx.Timeout] = DEFAULT_POSTGREST_CLIENT_TIMEOUT,
+        verify: bool = True,
+        proxy: Optional[str] = None,
+    ) -> AsyncPostgrestClient:
+        return _PooledPostgrestClient(
+            rest_url,
+            headers=headers,
+            schema=schema,
+            timeout=timeout,
+            verify=verify,
+            proxy=proxy,
+        )
+
+
+# Constructed at import so every module shares one client; its HTTP sessions are
+# opened lazily on the first awaited request and closed on app shutdown.
+supabase: AsyncClient = _Client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
+
+
+async def close_supabase() -> None:
+    await supabase.postgrest.aclose()
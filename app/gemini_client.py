@@ -1,59 +1,134 @@
-import json
+import asyncio
+import random
+from contextlib import suppress
+from functools import lru_cache
+from typing import Optional
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 from fastapi import HTTPException
+from pydantic import ValidationError
 from .config import settings
 
 
 def _is_quota_error(e: Exception) -> bool:
-    status = getattr(e, "status_code", None)
-    if status == 429:
-        return True
-
-    err = {}
-    if getattr(e, "args", None) and len(e.args) > 0 and isinstance(e.args[0], dict):
-        err = e.args[0].get("error") or {}
-
-    if err.get("code") == 429:
+    # google-genai errors carry the HTTP status as an int
+    if isinstance(e, errors.APIError):
+        return e.code == 429
+    if getattr(e, "status_code", None) == 429:
         return True
 
+    # unknown exception types: fall back to the message
     msg = str(e).lower()
     return ("resource_exhausted" in msg) or ("quota" in msg) or ("429" in msg)
 
 
 def _is_model_not_found(e: Exception) -> bool:
-    status = getattr(e, "status_code", None)
-    if status == 404:
+    if isinstance(e, errors.APIError):
+        return e.code == 404
+    if getattr(e, "status_code", None) == 404:
         return True
 
     msg = str(e).lower()
     return ("not_found" in msg) or ("is not found" in msg) or ("404" in msg)
 
 
+def _retry_delay(e: Exception) -> Optional[float]:
+    """
+    Seconds from Gemini's RetryInfo.retryDelay (e.g. "24s"), if the error carries one.
+    """
+    body = getattr(e, "details", None)
+    if not isinstance(body, dict) and getattr(e, "args", None) and len(e.args) > 0 and isinstance(e.args[0], dict):
+        body = e.args[0]
+    if not isinstance(body, dict):
+        return None
+
+    err = body.get("error") or body
+    for d in err.get("details") or []:
+        if isinstance(d, dict) and str(d.get("@type", "")).endswith("google.rpc.RetryInfo"):
+            try:
+                return float(str(d.get("retryDelay", "")).rstrip("s"))
+            except ValueError:
+                return None
+    return None
+
+
+# 429 handling: exponential backoff + jitter, or the server's retryDelay when given
+QUOTA_ATTEMPTS = 4
+QUOTA_MAX_DELAY = 30.0
+
+
+# next() default marking the end of a sync stream (StopIteration can't cross to_thread)
+_STREAM_END = object()
+
+
+JSON_GUARD = (
+    "Return ONLY valid JSON. No markdown. No extra keys. "
+    "If you cannot comply, return an empty JSON object: {}."
+)
+
+
+# System prompts are a few module constants (prompts.py): build each request
+# config once. Sent as system_instruction ahead of the per-call contents, the
+# prompt is an identical prefix on every call, which Gemini's implicit
+# context caching can reuse server-side.
+@lru_cache(maxsize=16)
+def _text_config(system: str) -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(
+        system_instruction=system,
+        response_mime_type="text/plain",
+        temperature=0.7,
+    )
+
+
+@lru_cache(maxsize=16)
+def _structured_config(system: str) -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(
+        system_instruction=system.strip() + "\n\n" + JSON_GUARD,
+        response_mime_type="application/json",
+        temperature=0.3,
+    )
+
+
 class GeminiClient:
     def __init__(self):
         self.enabled = bool(getattr(settings, "GEMINI_API_KEY", None))
         self.client = genai.Client(api_key=settings.GEMINI_API_KEY) if self.enabled else None
 
-    def generate_text(self, model: str, system: str, user_text: str) -> str:
+    async def _generate(self, **kwargs):
+        """
+        generate_content with retries on quota errors (429 / RESOURCE_EXHAUSTED).
+        Gives up early when Gemini asks for a wait longer than QUOTA_MAX_DELAY.
+        """
+        for attempt in range(QUOTA_ATTEMPTS):
+            try:
+                return await self.client.aio.models.generate_content(**kwargs)
+            except Exception as e:
+                if not _is_quota_error(e) or attempt == QUOTA_ATTEMPTS - 1:
+                    raise
+                delay = _retry_delay(e)
+                if delay is None:
+                    delay = min(2 ** attempt + random.random(), QUOTA_MAX_DELAY)
+                elif delay > QUOTA_MAX_DELAY:
+                    raise
+                await asyncio.sleep(delay)
+
+    async def generate_text(self, model: str, system: str, user_text: str) -> str:
         if not self.enabled or self.client is None:
             raise HTTPException(503, "AI service unavailable (missing API key)")
 
         try:
-            resp = self.client.models.generate_content(
+            resp = await self._generate(
                 model=model,
                 contents=[types.Content(role="user", parts=[types.Part(text=user_text)])],
-                config=types.GenerateContentConfig(
-                    system_instruction=system,
-                    response_mime_type="text/plain",
-                    temperature=0.7,
-                ),
+                config=_text_config(system),
             )
             text = (resp.text or "").strip()
             if not text:
                 raise HTTPException(503, "AI returned empty response")
             return text
 
+        except HTTPException:
+            raise
         except Exception as e:
             if _is_quota_error(e):
                 raise HTTPException(503, "AI service temporarily unavailable (quota exceeded)")
@@ -61,45 +136,82 @@ class GeminiClient:
                 raise HTTPException(503, "AI model not available (check model id/version)")
             raise HTTPException(500, f"AI generation failed: {type(e).__name__}: {e}")
 
-    def generate_structured(self, model: str, system: str, user_text: str, schema_model):
+    async def stream_text(self, model: str, system: str, user_text: str):
         """
-        Return object Pydantic (schema_model), agar main.py bisa akses parsed.language, dll.
+        Like generate_text, but yields the text chunks as Gemini produces them.
+        Quota errors are retried only until the first chunk has been yielded.
         """
         if not self.enabled or self.client is None:
             raise HTTPException(503, "AI service unavailable (missing API key)")
 
-        json_guard = (
-            "Return ONLY valid JSON. No markdown. No extra keys. "
-            "If you cannot comply, return an empty JSON object: {}."
-        )
-        sys = system.strip() + "\n\n" + json_guard
+        started = False
+        for attempt in range(QUOTA_ATTEMPTS):
+            try:
+                # google-genai's aio stream reads the response with blocking
+                # iter_lines() on the event loop: use the sync stream instead and
+                # pull each chunk in a worker thread
+                chunks = self.client.models.generate_content_stream(
+                    model=model,
+                    contents=[types.Content(role="user", parts=[types.Part(text=user_text)])],
+                    config=_text_config(system),
+                )
+                try:
+                    while True:
+                        chunk = await asyncio.to_thread(next, chunks, _STREAM_END)
+                        if chunk is _STREAM_END:
+                            break
+                        if chunk.text:
+                            started = True
+                            yield chunk.text
+                finally:
+                    # still running in its thread if we were cancelled mid-chunk
+                    with suppress(ValueError):
+                        chunks.close()
+                if not started:
+                    raise HTTPException(503, "AI returned empty response")
+                return
+
+            except HTTPException:
+                raise
+            except Exception as e:
+                if _is_quota_error(e):
+                    delay = _retry_delay(e)
+                    if delay is None:
+                        delay = min(2 ** attempt + random.random(), QUOTA_MAX_DELAY)
+                    if not started and attempt < QUOTA_ATTEMPTS - 1 and delay <= QUOTA_MAX_DELAY:
+                        await asyncio.sleep(delay)
+                        continue
+                    raise HTTPException(503, "AI service temporarily unavailable (quota exceeded)")
+                if _is_model_not_found(e):
+                    raise HTTPException(503, "AI model not available (check model id/version)")
+                raise HTTPException(500, f"AI generation failed: {type(e).__name__}: {e}")
+
+    async def generate_structured(self, model: str, system: str, user_text: str, schema_model):
+        """
+        Return object Pydantic (schema_model), agar main.py bisa akses parsed.language, dll.
+        """
+        if not self.enabled or self.client is None:
+            raise HTTPException(503, "AI service unavailable (missing API key)")
 
         try:
-            resp = self.client.models.generate_content(
+            resp = await self._generate(
                 model=model,
                 contents=[types.Content(role="user", parts=[types.Part(text=user_text)])],
-                config=types.GenerateContentConfig(
-                    system_instruction=sys,
-                    response_mime_type="application/json",
-                    temperature=0.3,
-                ),
+                config=_structured_config(system),
             )
 
             text = (resp.text or "").strip()
             if not text:
                 raise HTTPException(503, "AI returned empty structured output")
 
-            # pastikan JSON valid biar errornya jelas
-            try:
-                json.loads(text)
-            except Exception:
-                raise HTTPException(503, f"AI returned invalid JSON: {text[:200]}")
-
-            # parse -> pydantic model
+            # single pass: pydantic-core parses + validates the raw JSON text
             try:
                 return schema_model.model_validate_json(text)
-            except Exception as ve:
-                raise HTTPException(503, f"AI JSON did not match schema: {ve}")
+            except ValidationError as ve:
+                errs = ve.errors()
+                if errs and errs[0]["type"] == "json_invalid":
+                    raise HTTPException(503, f"AI returned invalid JSON: {text[:200]}")
+                raise HTTPException(503, f"AI JSON did not match schema: {errs[:3]}")
 
         except HTTPException:
             raise
@@ -110,5 +222,4 @@ class GeminiClient:
                 raise HTTPException(503, "AI model not available (check model id/version)")
             raise HTTPException(500, f"AI structured generation failed: {type(e).__name__}: {e}")
 
-
 gemini = GeminiClient()
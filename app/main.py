@@ -1,32 +1,72 @@
 from realtime import List
-from fastapi import FastAPI, Depends, HTTPException
+import asyncio
+import base64
+import hashlib
+import logging
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import orjson
+from cachetools import TTLCache
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import Response, ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 from .config import settings
 from .auth import get_current_user, require_admin
+from typing import Optional
 from uuid import UUID
 from datetime import datetime, timezone
-from .db import supabase
+from .db import supabase, close_supabase
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
 from fastapi.openapi.utils import get_openapi
+from fastapi.openapi.docs import get_swagger_ui_html, get_redoc_html
 from .models import (
     LoginResponse, SignupProfileUpdate, DashboardResponse,
     ChatSendRequest, ChatSendResponse,
     EndSessionResponse,
-    FeedbackStudentResponse, FeedbackAdminResponse,
+    FeedbackSchema, FeedbackStudentResponse, FeedbackAdminResponse,
     QuestionnaireSubmit, LoginRequest, LoginResponse
 )
 from .services import (
     ensure_16_sessions_seeded, get_available_session, normalize_skill_indicators, sessions_completed_this_week,
-    next_turn_index, get_history, gender_label, lock_and_unlock_next,
-    award_milestone_badge, award_skill_badges_if_ready, normalize_skill_indicators
+    get_history, get_recent_history, append_history, invalidate_history, session_lock,
+    gender_label, lock_and_unlock_next, invalidate_week_count, WEEKLY_SESSION_LIMIT,
+    award_milestone_badge, award_skill_badges_if_ready, normalize_skill_indicators, skill_indicators_from_mask
 )
 
 from .gemini_client import gemini
-from .prompts import PATIENT_SYSTEM_FR, PATIENT_SYSTEM_EN, EVAL_SYSTEM_FR, EVAL_SYSTEM_EN
-from .pdf_export import build_session_pdf, build_summary_pdf
+from .prompts import (
+    PATIENT_SYSTEMS, PATIENT_SYSTEM_EN, EVAL_SYSTEMS, EVAL_SYSTEM_EN,
+    PATIENT_OPENING_TEMPLATE, PATIENT_TURN_TEMPLATE, EVAL_TEMPLATE,
+)
+from .pdf_export import build_session_pdf, build_summary_pdf, render_summary_pdf
 from fastapi.requests import Request
 
-app = FastAPI(title="ALLIANCE OSTEO 2026 - MVP Backend")
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # routes are all registered by now: build + encode the schema once
+    app.state.openapi_bytes = orjson.dumps(app.openapi())
+    yield
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(cancel_futures=True)
+    await close_supabase()
+
+# /openapi.json and the docs pages are served below from the prebuilt schema bytes
+app = FastAPI(
+    title="ALLIANCE OSTEO 2026 - MVP Backend",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+    openapi_url=None,
+    docs_url=None,
+    redoc_url=None,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -51,14 +91,27 @@ def custom_openapi():
     return schema
 
 app.openapi = custom_openapi
+
+@app.get("/openapi.json", include_in_schema=False)
+async def openapi_json():
+    return Response(content=app.state.openapi_bytes, media_type="application/json")
+
+@app.get("/docs", include_in_schema=False)
+async def swagger_docs():
+    return get_swagger_ui_html(openapi_url="/openapi.json", title=f"{app.title} - Swagger UI")
+
+@app.get("/redoc", include_in_schema=False)
+async def redoc_docs():
+    return get_redoc_html(openapi_url="/openapi.json", title=f"{app.title} - ReDoc")
+
 @app.post("/auth/login", response_model=LoginResponse)
-def login(payload: LoginRequest):
+async def login(payload: LoginRequest):
     """
     Explicit login endpoint.
     Returns Bearer token for frontend usage.
     """
     try:
-        res = supabase.auth.sign_in_with_password({
+        res = await supabase.auth.sign_in_with_password({
             "email": payload.email,
             "password": payload.password,
         })
@@ -82,42 +135,64 @@ def login(payload: LoginRequest):
     
 
 @app.get("/debug/auth")
-def debug_auth(request: Request):
+async def debug_auth(request: Request):
     return {"authorization": request.headers.get("authorization")}
+# probes are polled continuously by infra: answer /debug/db from a 5s cache
+_probe_cache: TTLCache = TTLCache(maxsize=1, ttl=5)
+
 @app.get("/debug/db")
-def debug_db():
-    r = supabase.table("profiles").select("user_id").limit(1).execute()
-    return {"ok": True, "rows": len(r.data or [])}
+async def debug_db():
+    cached = _probe_cache.get("db")
+    if cached is None:
+        r = await supabase.table("profiles").select("user_id").limit(1).execute()
+        cached = _probe_cache["db"] = {"ok": True, "rows": len(r.data or [])}
+    return cached
 
 
 @app.get("/health")
-def health():
+async def health():
     return {"ok": True}
 
 @app.post("/me/profile")
-def update_profile(payload: SignupProfileUpdate, user=Depends(get_current_user)):
-    supabase.table("profiles").upsert(
+async def update_profile(payload: SignupProfileUpdate, user=Depends(get_current_user)):
+    await supabase.table("profiles").upsert(
         {
             "user_id": user["user_id"],
             "level": payload.level,  # enum
             "preferred_language": payload.preferred_language,
         },
         on_conflict="user_id",
+        returning=ReturnMethod.minimal,
     ).execute()
 
     return {"ok": True}
 
 
 @app.get("/student/dashboard", response_model=DashboardResponse)
-def student_dashboard(user=Depends(get_current_user)):
-    ensure_16_sessions_seeded(user["user_id"])
-    sessions = supabase.table("sessions").select("id,session_number,status,patient_age,patient_gender").eq("user_id", user["user_id"]).order("session_number").execute().data
+async def student_dashboard(user=Depends(get_current_user)):
+    user_id = user["user_id"]
+
+    # sessions depend on seeding, badges don't: overlap the two chains
+    async def load_sessions():
+        await ensure_16_sessions_seeded(user_id)
+        return await (
+            supabase.table("sessions")
+            .select("id,session_number,status,patient_age,patient_gender")
+            .eq("user_id", user_id)
+            .order("session_number")
+            .execute()
+        )
+
+    sessions_resp, badges_resp = await asyncio.gather(
+        load_sessions(),
+        supabase.table("badges").select("badge_code").eq("user_id", user_id).execute(),
+    )
+    sessions = sessions_resp.data or []
 
     completed = sum(1 for s in sessions if s["status"] == "completed")
     available = next((s["session_number"] for s in sessions if s["status"] in ("available", "in_progress")), 16 if completed==16 else 1)
 
-    badges = supabase.table("badges").select("badge_code").eq("user_id", user["user_id"]).execute().data
-    badge_codes = [b["badge_code"] for b in (badges or [])]
+    badge_codes = [b["badge_code"] for b in (badges_resp.data or [])]
 
     return {
         "completed": completed,
@@ -127,8 +202,8 @@ def student_dashboard(user=Depends(get_current_user)):
     }
 
 @app.get("/student/sessions/current")
-def current_session(user=Depends(get_current_user)):
-    ses = get_available_session(user["user_id"])
+async def current_session(user=Depends(get_current_user)):
+    ses = await get_available_session(user["user_id"])
     if not ses:
         return {"done": True}
     lang = user.get("preferred_language", "fr")
@@ -141,21 +216,27 @@ def current_session(user=Depends(get_current_user)):
     }
 
 @app.get("/student/sessions/current-id")
-def current_session_id(user=Depends(get_current_user)):
-    ses = get_available_session(user["user_id"])
+async def current_session_id(user=Depends(get_current_user)):
+    ses = await get_available_session(user["user_id"])
     return {"session_id": ses["id"], "session_number": ses["session_number"]}
 
-@app.post("/student/sessions/{session_id}/chat", response_model=ChatSendResponse)
-def chat_send(session_id: str, payload: ChatSendRequest, user=Depends(get_current_user)):
-    ses = (
+async def _open_chat_session(session_id: str, user: dict):
+    """
+    Load the session for a chat turn and run the status / weekly-limit checks.
+    Returns (session, starting).
+    """
+    # the weekly count is only needed for an "available" session, but it is a
+    # cached single-row read: fetch it alongside the session instead of after it
+    resp, week_count = await asyncio.gather(
         supabase.table("sessions")
         .select("*")
         .eq("id", session_id)
         .eq("user_id", user["user_id"])
         .single()
-        .execute()
-        .data
+        .execute(),
+        sessions_completed_this_week(user["user_id"]),
     )
+    ses = resp.data
 
     if ses["status"] == "completed":
         raise HTTPException(400, "Session already completed")
@@ -163,72 +244,27 @@ def chat_send(session_id: str, payload: ChatSendRequest, user=Depends(get_curren
         raise HTTPException(403, "Session locked")
 
     # Weekly limit: only blocks starting a NEW session (available -> in_progress)
-    if ses["status"] == "available":
-        if sessions_completed_this_week(user["user_id"]) >= 2:
-            raise HTTPException(403, "Limite: 2 sessions par semaine")
-        supabase.table("sessions").update({
-            "status": "in_progress",
-            "started_at": ses.get("started_at") or datetime.now(timezone.utc).isoformat(),
-        }).eq("id", session_id).execute()
+    starting = ses["status"] == "available"
+    # (cached pre-check; chat_send_tx enforces it again atomically)
+    if starting and week_count >= WEEKLY_SESSION_LIMIT:
+        raise HTTPException(403, "Limite: 2 sessions par semaine")
+    return ses, starting
 
-    # ✅ PATIENT STARTS SOMETIMES (MUST BE HERE)
-    # Only once, only if no messages yet
-    existing_msg = (
-        supabase.table("messages")
-        .select("id")
-        .eq("session_id", session_id)
-        .limit(1)
-        .execute()
-    ).data or []
-
-    if (not existing_msg) and bool(ses.get("patient_opening_starts")):
-        lang = user.get("preferred_language", "fr")
-        system = PATIENT_SYSTEM_FR if lang == "fr" else PATIENT_SYSTEM_EN
-
-        ctx_open = {
-            "session_number": ses["session_number"],
-            "patient_age": ses["patient_age"],
-            "patient_gender_label": gender_label(ses["patient_age"], ses["patient_gender"], lang),
-            "difficulty": ses["difficulty"],
-            "reorientation": ses["reorientation"],
-            "opening_patient_starts": True,
-            "language": lang,
-        }
 
-        opening_user_text = f"""
-CONTEXTE (JSON):
-{ctx_open}
-
-INSTRUCTION:
-Tu es le PATIENT. Commence la consultation de manière naturelle et humaine.
-1 à 3 phrases. Pas de diagnostic, pas de pathologie, pas de phrases génériques.
-"""
-
-        opening_msg = gemini.generate_text(settings.GEMINI_MODEL_CHAT, system, opening_user_text)
-
-        t0 = next_turn_index(session_id)
-        supabase.table("messages").insert({
-            "session_id": session_id,
-            "user_id": user["user_id"],
-            "turn_index": t0,
-            "role": "patient",
-            "content": opening_msg
-        }).execute()
+async def _prepare_chat_turn(session_id: str, ses: dict, user: dict, message: str):
+    """
+    Build the patient prompt for one chat turn (caller holds session_lock).
+    Returns (lang, system, user_text, new_rows); the patient reply still has to be added to new_rows.
+    """
+    hist = await get_recent_history(session_id, settings.HISTORY_TURNS)
+    # turn_index is assigned by chat_send_tx, in the order rows are added here
+    new_rows = []
 
-    # store student message
-    t = next_turn_index(session_id)
-    supabase.table("messages").insert({
-        "session_id": session_id,
-        "user_id": user["user_id"],
-        "turn_index": t,
-        "role": "student",
-        "content": payload.message
-    }).execute()
+    def add_row(role: str, content: str):
+        new_rows.append({"role": role, "content": content})
 
-    # build prompt with short history
-    hist = get_history(session_id, settings.HISTORY_TURNS)
     lang = user.get("preferred_language", "fr")
-    system = PATIENT_SYSTEM_FR if lang == "fr" else PATIENT_SYSTEM_EN
+    system = PATIENT_SYSTEMS.get(lang, PATIENT_SYSTEM_EN)
 
     ctx = {
         "session_number": ses["session_number"],
@@ -240,30 +276,46 @@ Tu es le PATIENT. Commence la consultation de manière naturelle et humaine.
         "language": lang,
     }
 
-    history_text = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in hist])
-    user_text = f"""
-CONTEXTE (JSON):
-{ctx}
+    # ✅ PATIENT STARTS SOMETIMES (MUST BE HERE)
+    # Only once, only if no messages yet
+    if not hist and bool(ses.get("patient_opening_starts")):
+        ctx_open = orjson.dumps({**ctx, "opening_patient_starts": True}).decode()
+        opening_user_text = PATIENT_OPENING_TEMPLATE.format_map({"ctx": ctx_open})
 
-HISTORIQUE:
-{history_text}
+        opening_msg = await gemini.generate_text(settings.GEMINI_MODEL_CHAT, system, opening_user_text)
+        add_row("patient", opening_msg)
 
-INSTRUCTION:
-Réponds uniquement comme le PATIENT. Réponse naturelle, courte à moyenne (1-5 phrases).
-"""
+    add_row("student", message)
 
-    patient_msg = gemini.generate_text(settings.GEMINI_MODEL_CHAT, system, user_text)
+    # build prompt with short history (stored turns + the ones not written yet)
+    hist = (hist + new_rows)[-settings.HISTORY_TURNS:]
+
+    history_text = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in hist])
+    user_text = PATIENT_TURN_TEMPLATE.format_map({
+        "ctx": orjson.dumps(ctx).decode(),
+        "history": history_text,
+    })
+    return lang, system, user_text, new_rows
 
-    # store patient message
-    t2 = next_turn_index(session_id)
-    supabase.table("messages").insert({
-        "session_id": session_id,
-        "user_id": user["user_id"],
-        "turn_index": t2,
-        "role": "patient",
-        "content": patient_msg
-    }).execute()
 
+async def _store_chat_turn(session_id: str, user: dict, starting: bool, new_rows: list):
+    # start the session + store all new messages in one transaction (chat_send_tx RPC)
+    try:
+        await supabase.rpc("chat_send_tx", {
+            "p_session_id": session_id,
+            "p_user_id": user["user_id"],
+            "p_start": starting,
+            "p_messages": new_rows,
+            "p_weekly_limit": WEEKLY_SESSION_LIMIT,
+        }).execute()
+    except APIError as e:
+        if e.message == "weekly_limit":
+            raise HTTPException(403, "Limite: 2 sessions par semaine")
+        raise
+    append_history(session_id, new_rows, settings.HISTORY_TURNS)
+
+
+def _chat_response(ses: dict, lang: str, patient_msg: str) -> ChatSendResponse:
     return ChatSendResponse(
         patient_message=patient_msg,
         language=lang,
@@ -272,21 +324,80 @@ Réponds uniquement comme le PATIENT. Réponse naturelle, courte à moyenne (1-5
         patient_gender_label=gender_label(ses["patient_age"], ses["patient_gender"], lang),
     )
 
+
+@app.post("/student/sessions/{session_id}/chat", response_model=ChatSendResponse)
+async def chat_send(session_id: str, payload: ChatSendRequest, user=Depends(get_current_user)):
+    ses, starting = await _open_chat_session(session_id, user)
+
+    # one turn at a time per session: the cached history assumes no
+    # other turn of this session is in flight
+    async with session_lock(session_id):
+        lang, system, user_text, new_rows = await _prepare_chat_turn(session_id, ses, user, payload.message)
+        patient_msg = await gemini.generate_text(settings.GEMINI_MODEL_CHAT, system, user_text)
+        new_rows.append({"role": "patient", "content": patient_msg})
+        await _store_chat_turn(session_id, user, starting, new_rows)
+
+    return _chat_response(ses, lang, patient_msg)
+
+
+def _sse(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+@app.post("/student/sessions/{session_id}/chat/stream")
+async def chat_send_stream(session_id: str, payload: ChatSendRequest, user=Depends(get_current_user)):
+    """
+    Same turn as /chat, sent as Server-Sent Events while Gemini writes it:
+    "delta" events ({"text": ...}), then "done" (the ChatSendResponse) once the
+    turn is stored, or "error" ({"status_code", "detail"}) if it fails midway.
+    """
+    ses, starting = await _open_chat_session(session_id, user)
+
+    async def events():
+        try:
+            async with session_lock(session_id):
+                lang, system, user_text, new_rows = await _prepare_chat_turn(session_id, ses, user, payload.message)
+                parts = []
+                async for text in gemini.stream_text(settings.GEMINI_MODEL_CHAT, system, user_text):
+                    parts.append(text)
+                    yield _sse("delta", {"text": text})
+
+                # the whole reply is stored at once, after the stream completes
+                patient_msg = "".join(parts).strip()
+                new_rows.append({"role": "patient", "content": patient_msg})
+                await _store_chat_turn(session_id, user, starting, new_rows)
+            yield _sse("done", _chat_response(ses, lang, patient_msg).model_dump())
+        except HTTPException as e:
+            yield _sse("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            # headers are already sent: report it in-stream instead of dropping the connection
+            logger.exception("chat stream failed for session %s", session_id)
+            yield _sse("error", {"status_code": 500, "detail": f"Chat turn failed: {type(e).__name__}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/student/sessions/{session_id}/end", response_model=EndSessionResponse)
-def end_session(session_id: str, user=Depends(get_current_user)):
-    ses = supabase.table("sessions").select("*").eq("id", session_id).eq("user_id", user["user_id"]).single().execute().data
+async def end_session(session_id: str, background_tasks: BackgroundTasks, user=Depends(get_current_user)):
+    ses = (await supabase.table("sessions").select("*").eq("id", session_id).eq("user_id", user["user_id"]).single().execute()).data
     if ses["status"] == "completed":
         return {"session_id": session_id, "status": "completed"}
 
     # mark ended
     
-    supabase.table("sessions").update({
+    await supabase.table("sessions").update({
     "status": "completed",
     "ended_at": datetime.now(timezone.utc).isoformat(),
-}).eq("id", session_id).execute()
-    # unlock next
-    lock_and_unlock_next(user["user_id"], ses["session_number"])
-    award_milestone_badge(user["user_id"], ses["session_number"])
+}, returning=ReturnMethod.minimal).eq("id", session_id).execute()
+    invalidate_history(session_id)
+    invalidate_week_count(user["user_id"])
+    # unlock next before responding: clients read /sessions/current right after /end
+    await lock_and_unlock_next(user["user_id"], ses["session_number"])
+    # milestone badge: run after the response is sent
+    background_tasks.add_task(award_milestone_badge, user["user_id"], ses["session_number"])
 
 
     return {"session_id": session_id, "status": "completed"}
@@ -295,9 +406,9 @@ def end_session(session_id: str, user=Depends(get_current_user)):
 
 
 @app.get("/student/badges")
-def student_badges(user=Depends(get_current_user)):
+async def student_badges(user=Depends(get_current_user)):
     resp = (
-        supabase.table("badges")
+        await supabase.table("badges")
         .select("badge_code")
         .eq("user_id", user["user_id"])
         .execute()
@@ -307,18 +418,25 @@ def student_badges(user=Depends(get_current_user)):
 
 
 @app.post("/student/sessions/{session_id}/generate-feedback", response_model=FeedbackStudentResponse)
-def generate_feedback(session_id: UUID, user=Depends(get_current_user)):
+async def generate_feedback(session_id: UUID, background_tasks: BackgroundTasks, user=Depends(get_current_user)):
     session_id = str(session_id)
 
-    ses = (
+    # session + existing feedback are independent reads: fetch together
+    ses_resp, existing_resp = await asyncio.gather(
         supabase.table("sessions")
         .select("*")
         .eq("id", session_id)
         .eq("user_id", user["user_id"])
         .limit(1)
-        .execute()
-        .data
+        .execute(),
+        supabase.table("feedback")
+        .select("*")
+        .eq("session_id", session_id)
+        .limit(1)
+        .execute(),
     )
+
+    ses = ses_resp.data
     if not ses:
         raise HTTPException(404, "Session not found")
     ses = ses[0]
@@ -326,82 +444,69 @@ def generate_feedback(session_id: UUID, user=Depends(get_current_user)):
     if ses["status"] != "completed":
         raise HTTPException(403, "Feedback only after completion")
 
-    existing_resp = (
-        supabase.table("feedback")
-        .select("*")
-        .eq("session_id", session_id)
-        .limit(1)
-        .execute()
-    )
     if (existing_resp.data or []):
         return existing_resp.data[0]
 
-    hist = get_history(session_id, 400)  # full transcript for eval
+    # full transcript for eval: only once we know feedback has to be generated
+    hist = await get_history(session_id, 400)
+
     lang = user.get("preferred_language", "fr")
-    system = EVAL_SYSTEM_FR if lang == "fr" else EVAL_SYSTEM_EN
+    system = EVAL_SYSTEMS.get(lang, EVAL_SYSTEM_EN)
 
     transcript = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in hist])
 
-    prompt = f"""
-Tu vas analyser une anamnèse (sans diagnostic). Tu dois produire STRICTEMENT du JSON suivant le schéma.
-Langue attendue: {lang}.
-
-METADATA:
-- session_number: {ses["session_number"]}
-- patient_age: {ses["patient_age"]}
-- patient_gender: {ses["patient_gender"]}
-- difficulty(hidden): {ses["difficulty"]}
-- reorientation: {ses["reorientation"]}
-
-TRANSCRIPT:
-{transcript}
-
-CONTRAINTES JSON:
-- internal_scores: empathy/structure/alliance entiers 1..5
-- student_facing: strengths 3..5, areas_to_improve 3..5, reflective_question 1
-- skill_indicators booleans: active_listening, reformulation, emotional_validation, open_questions, structure_clarity
-- kpis: peux inclure open_questions_ratio (0..1), interruptions_estimate (int), etc.
-"""
+    prompt = EVAL_TEMPLATE.format_map({
+        "lang": lang,
+        "session_number": ses["session_number"],
+        "patient_age": ses["patient_age"],
+        "patient_gender": ses["patient_gender"],
+        "difficulty": ses["difficulty"],
+        "reorientation": ses["reorientation"],
+        "transcript": transcript,
+    })
+
     try:
     # 1️⃣ Generate FULL feedback (admin/internal version)
-        parsed = gemini.generate_structured(
+        parsed = await gemini.generate_structured(
             settings.GEMINI_MODEL_EVAL,
             system,
             prompt,
-            FeedbackAdminResponse,   # ⬅️ PENTING
+            FeedbackSchema,   # ⬅️ PENTING
         )
 
-    # 2️⃣ Store FULL internal data in DB
-        supabase.table("feedback").insert({
-            "session_id": session_id,
-            "user_id": user["user_id"],
-            "language": parsed.language,
-            "student_facing": parsed.student_facing.model_dump(),
-            "internal_scores": parsed.internal_scores,
-            "skill_indicators": parsed.skill_indicators.model_dump(),
-            "kpis": parsed.kpis,
-        }).execute()
-
-    # 3️⃣ Award skill-based badges (threshold = 3 sessions)
-        award_skill_badges_if_ready(user["user_id"], threshold=3)
+    # 2️⃣ Store FULL internal data in DB: one RPC re-checks ownership/completion and
+    # keeps the first feedback if a concurrent request already stored one
+        stored = (await supabase.rpc("feedback_upsert_if_missing", {
+            "p_session_id": session_id,
+            "p_user_id": user["user_id"],
+            "p_feedback": {
+                "language": parsed.language,
+                "student_facing": parsed.student_facing.model_dump(),
+                "internal_scores": parsed.internal_scores.model_dump(),
+                "skill_indicators": parsed.skill_indicators.model_dump(),
+                "kpis": parsed.kpis,
+            },
+        }).execute()).data or []
 
     except Exception as e:
         raise HTTPException(503, f"LLM unavailable: {e}")
 
-# 4️⃣ Return STUDENT-SAFE response only
-    return FeedbackStudentResponse(
-        language=parsed.language,
-        student_facing=parsed.student_facing,
-        internal_scores=parsed.internal_scores,  # boleh ditampilkan sebagai "indicators"
-    )
+    if not stored:
+        raise HTTPException(403, "Feedback only after completion")
+
+    # 3️⃣ Award skill-based badges (threshold = 3 sessions), after the response is sent
+    background_tasks.add_task(award_skill_badges_if_ready, user["user_id"], threshold=3)
+
+# 4️⃣ Return STUDENT-SAFE response only (response_model drops the internal fields)
+    return stored[0]
 
 
 @app.post("/student/sessions/{session_id}/questionnaire")
-def submit_questionnaire(session_id: UUID, payload: QuestionnaireSubmit, user=Depends(get_current_user)):
+async def submit_questionnaire(session_id: UUID, payload: QuestionnaireSubmit, user=Depends(get_current_user)):
     session_id = str(session_id)
 
     fb_resp = (
-        supabase.table("feedback")
+        await supabase.table("feedback")
         .select("session_id")
         .eq("session_id", session_id)
         .limit(1)
@@ -411,13 +516,13 @@ def submit_questionnaire(session_id: UUID, payload: QuestionnaireSubmit, user=De
     if not (fb_resp.data or []):
         raise HTTPException(403, "Questionnaire after feedback")
 
-    supabase.table("questionnaire").upsert({
+    await supabase.table("questionnaire").upsert({
         "session_id": session_id,
         "user_id": user["user_id"],
         "q1": payload.q1,
         "q2": payload.q2,
         "open_answer": payload.open_answer
-    }).execute()
+    }, returning=ReturnMethod.minimal).execute()
 
     return {"ok": True}
 
@@ -425,22 +530,73 @@ def submit_questionnaire(session_id: UUID, payload: QuestionnaireSubmit, user=De
 # ADMIN ENDPOINTS
 # ======================
 
+# read-only admin dashboard tiles: refreshes within 30s are served from memory
+_admin_cache: TTLCache = TTLCache(maxsize=128, ttl=30)
+
 @app.get("/admin/stats")
-def admin_stats(admin=Depends(require_admin)):
-    # simple aggregates (MVP)
-    students = supabase.table("profiles").select("user_id", count="exact").eq("role", "student").execute().count or 0
-    sessions_completed = supabase.table("sessions").select("id", count="exact").eq("status", "completed").execute().count or 0
-    return {"students": students, "sessions_completed": sessions_completed}
+async def admin_stats(admin=Depends(require_admin)):
+    # simple aggregates (MVP): trigger-maintained counters, no count(*) scans
+    rows = (
+        await supabase.table("counters")
+        .select("key,n")
+        .in_("key", ["students", "sessions_completed"])
+        .execute()
+    ).data or []
+    counts = {r["key"]: r["n"] for r in rows}
+    return {"students": counts.get("students", 0), "sessions_completed": counts.get("sessions_completed", 0)}
+
+def _encode_students_cursor(row: dict) -> str:
+    # opaque + URL-safe: the raw timestamp's "+" would come back as a space unencoded
+    raw = orjson.dumps([row["created_at"], row["user_id"]])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_students_cursor(cursor: str) -> tuple:
+    try:
+        created_at, user_id = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at).isoformat(), str(UUID(user_id))
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Invalid cursor")
+
 
 @app.get("/admin/students")
-def admin_students(admin=Depends(require_admin)):
-    res = supabase.table("profiles").select("user_id,email,level,preferred_language,created_at").eq("role", "student").order("created_at", desc=True).execute().data
-    return {"students": res}
+async def admin_students(
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    admin=Depends(require_admin),
+):
+    # keyset pagination on (created_at, user_id), newest first: pass next_cursor
+    # back as ?before= for the next page (user_id breaks created_at ties)
+    key = ("students", limit, before)
+    cached = _admin_cache.get(key)
+    if cached is None:
+        q = (
+            supabase.table("profiles")
+            .select("user_id,email,level,preferred_language,created_at")
+            .eq("role", "student")
+        )
+        if before is not None:
+            created_at, user_id = _decode_students_cursor(before)
+            q = q.or_(
+                f'created_at.lt."{created_at}",'
+                f'and(created_at.eq."{created_at}",user_id.lt.{user_id})'
+            )
+        res = (
+            await q.order("created_at", desc=True)
+            .order("user_id", desc=True)
+            .limit(limit)
+            .execute()
+        ).data or []
+        cached = _admin_cache[key] = {
+            "students": res,
+            "next_cursor": _encode_students_cursor(res[-1]) if len(res) == limit else None,
+        }
+    return cached
 
 @app.get("/admin/student/{user_id}/sessions")
-def admin_student_sessions(user_id: str, admin=Depends(require_admin)):
+async def admin_student_sessions(user_id: str, admin=Depends(require_admin)):
     resp = (
-        supabase.table("sessions")
+        await supabase.table("sessions")
         .select("*")
         .eq("user_id", user_id)
         .order("session_number")
@@ -450,48 +606,31 @@ def admin_student_sessions(user_id: str, admin=Depends(require_admin)):
     return {"sessions": sess}
 
 
+PDF_CHUNK_SIZE = 64 * 1024
+
+async def _pdf_response(build, **kwargs) -> StreamingResponse:
+    buf = BytesIO()
+    # reportlab is CPU-bound: render off the event loop
+    await run_in_threadpool(build, out=buf, **kwargs)
+    buf.seek(0)
+    # send straight from the render buffer, without copying it into one bytes body
+    return StreamingResponse(iter(lambda: buf.read(PDF_CHUNK_SIZE), b""), media_type="application/pdf")
+
+
 @app.get("/admin/sessions/{session_id}/pdf")
-def admin_session_pdf(session_id: str, admin=Depends(require_admin)):
-    ses_resp = (
-        supabase.table("sessions")
-        .select("*")
-        .eq("id", session_id)
-        .single()
-        .execute()
-    )
-    ses = ses_resp.data if ses_resp else None
-    if not ses:
+async def admin_session_pdf(session_id: str, admin=Depends(require_admin)):
+    # session + feedback + transcript + profile level in one RPC
+    bundle = (await supabase.rpc("get_session_pdf_bundle", {"p_session_id": session_id}).execute()).data
+    if not bundle:
         raise HTTPException(404, "Session not found")
+    ses = bundle["session"]
 
-    fb_resp = (
-        supabase.table("feedback")
-        .select("*")
-        .eq("session_id", session_id)
-        .maybe_single()
-        .execute()
-    )
-    fb = fb_resp.data if fb_resp else None
+    fb = bundle["feedback"]
     if not fb:
         raise HTTPException(404, "No feedback for this session yet")
 
-    msgs_resp = (
-        supabase.table("messages")
-        .select("role,content,turn_index")
-        .eq("session_id", session_id)
-        .order("turn_index")
-        .execute()
-    )
-    msgs = (msgs_resp.data if msgs_resp else None) or []
-
-    prof_resp = (
-        supabase.table("profiles")
-        .select("level")
-        .eq("user_id", ses["user_id"])
-        .maybe_single()
-        .execute()
-    )
-    prof = prof_resp.data if prof_resp else None
-    academic_year = (prof or {}).get("level")
+    msgs = bundle["messages"]
+    academic_year = bundle["level"]
 
     meta = {
         "Student (user_id)": ses["user_id"],
@@ -503,48 +642,25 @@ def admin_session_pdf(session_id: str, admin=Depends(require_admin)):
         "Indicators": str(fb.get("skill_indicators")),
     }
 
-    pdf_bytes = build_session_pdf(
+    return await _pdf_response(
+        build_session_pdf,
         title=f"ALLIANCE OSTEO 2026 — Session {ses['session_number']}",
         meta=meta,
         feedback={"student_facing": fb["student_facing"]},
         transcript=msgs,
     )
-    return Response(content=pdf_bytes, media_type="application/pdf")
 
-@app.get("/admin/student/{user_id}/summary-pdf")
-def admin_student_summary_pdf(user_id: str, admin=Depends(require_admin)):
-    # fetch sessions for this student
-    sess_rows = (
-        supabase.table("sessions")
-        .select("id,session_number,ended_at,difficulty")
-        .eq("user_id", user_id)
-        .order("session_number")
-        .execute()
-    ).data or []
+# summary PDFs are re-downloaded often while the data rarely changes:
+# rendered bytes are kept per content fingerprint
+_summary_pdf_cache: TTLCache = TTLCache(maxsize=256, ttl=3600)
 
-    if not sess_rows:
-        raise HTTPException(404, "Student has no sessions")
+SUMMARY_PDF_TITLE = "ALLIANCE OSTEO 2026 — Summary Report (16 sessions)"
 
-    # fetch all feedback for these sessions
-    session_ids = [s["id"] for s in sess_rows]
-    fb_rows = (
-        supabase.table("feedback")
-        .select("session_id,internal_scores,skill_indicators")
-        .in_("session_id", session_ids)
-        .execute()
-    ).data or []
 
+def _summary_pdf_inputs(user_id: str, sess_rows: list, fb_rows: list, prof: dict):
+    """(meta, rows) for build_summary_pdf from a student's sessions, feedback and profile."""
     fb_map = {f["session_id"]: f for f in fb_rows}
 
-    # profile academic year
-    prof = (
-        supabase.table("profiles")
-        .select("level,email")
-        .eq("user_id", user_id)
-        .maybe_single()
-        .execute()
-    ).data or {}
-
     rows = []
     completed_count = 0
     for s in sess_rows:
@@ -556,7 +672,7 @@ def admin_student_summary_pdf(user_id: str, admin=Depends(require_admin)):
             "ended_at": str(s.get("ended_at") or ""),
             "difficulty": s.get("difficulty"),
             "internal_scores": f.get("internal_scores") or {},
-            "skill_indicators": f.get("skill_indicators") or {},
+            "skill_indicators": skill_indicators_from_mask(f.get("skill_indicators_mask")),
         })
 
     meta = {
@@ -565,110 +681,169 @@ def admin_student_summary_pdf(user_id: str, admin=Depends(require_admin)):
         "Academic year": prof.get("level") or "",
         "Completed sessions": f"{completed_count}/16",
     }
+    return meta, rows
 
-    pdf_bytes = build_summary_pdf(
-        title="ALLIANCE OSTEO 2026 — Summary Report (16 sessions)",
-        meta=meta,
-        rows=rows,
-    )
-    return Response(content=pdf_bytes, media_type="application/pdf")
 
-@app.get("/admin/analytics/summary")
-def admin_analytics_summary(admin=Depends(require_admin)):
-    # Pull all feedback
-    fb_rows = (
-        supabase.table("feedback")
-        .select("session_id,user_id,internal_scores")
-        .execute()
-    ).data or []
+def _summary_pdf_etag(meta: dict, rows: list) -> str:
+    # the PDF is a pure function of meta + rows: fingerprint them for the ETag / render cache
+    return '"' + hashlib.blake2b(orjson.dumps([meta, rows], option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest() + '"'
 
-    # Sessions map: session_id -> session_number
-    sess_rows = (
-        supabase.table("sessions")
-        .select("id,session_number,user_id")
-        .execute()
-    ).data or []
-    sess_map = {s["id"]: s for s in sess_rows}
 
-    # Profiles map: user_id -> level
-    prof_rows = (
+@app.get("/admin/student/{user_id}/summary-pdf")
+async def admin_student_summary_pdf(user_id: str, request: Request, admin=Depends(require_admin)):
+    # sessions, feedback and profile only depend on user_id: fetch together
+    # (feedback filtered by user_id, so it needs no session ids first)
+    sess_resp, fb_resp, prof_resp = await asyncio.gather(
+        supabase.table("sessions")
+        .select("id,session_number,ended_at,difficulty")
+        .eq("user_id", user_id)
+        .order("session_number")
+        .execute(),
+        supabase.table("feedback")
+        .select("session_id,internal_scores,skill_indicators_mask")
+        .eq("user_id", user_id)
+        .execute(),
         supabase.table("profiles")
-        .select("user_id,level")
-        .execute()
-    ).data or []
-    level_map = {p["user_id"]: p.get("level") for p in prof_rows}
-
-    def add_score(acc, key, val):
-        if val is None:
-            return
-        acc[key]["sum"] += int(val)
-        acc[key]["n"] += 1
-
-    def finalize(acc):
-        out = {}
-        for k, v in acc.items():
-            out[k] = (v["sum"] / v["n"]) if v["n"] else None
-        return out
-
-    # overall accumulators
-    overall = {
-        "empathy": {"sum": 0, "n": 0},
-        "structure": {"sum": 0, "n": 0},
-        "alliance": {"sum": 0, "n": 0},
-    }
+        .select("level,email")
+        .eq("user_id", user_id)
+        .maybe_single()
+        .execute(),
+    )
 
-    # by level (4e/5e/autre)
-    by_level = {}
+    sess_rows = sess_resp.data or []
+    if not sess_rows:
+        raise HTTPException(404, "Student has no sessions")
 
-    # by session_number (1..16)
-    by_session = {}
+    # profile academic year
+    prof = (prof_resp.data if prof_resp else None) or {}
+    meta, rows = _summary_pdf_inputs(user_id, sess_rows, fb_resp.data or [], prof)
+
+    etag = _summary_pdf_etag(meta, rows)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    pdf_bytes = _summary_pdf_cache.get(etag)
+    if pdf_bytes is None:
+        buf = BytesIO()
+        await run_in_threadpool(
+            build_summary_pdf,
+            title=SUMMARY_PDF_TITLE,
+            meta=meta,
+            rows=rows,
+            out=buf,
+        )
+        pdf_bytes = _summary_pdf_cache[etag] = buf.getvalue()
+    return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
 
-    for f in fb_rows:
-        scores = f.get("internal_scores") or {}
-        sid = f.get("session_id")
-        uid = f.get("user_id")
 
-        # overall
-        add_score(overall, "empathy", scores.get("empathy"))
-        add_score(overall, "structure", scores.get("structure"))
-        add_score(overall, "alliance", scores.get("alliance"))
+# reportlab holds the GIL while drawing: cohort exports render in worker processes
+_pdf_pool: Optional[ProcessPoolExecutor] = None
 
-        # by level
-        lvl = level_map.get(uid) or "autre"
-        by_level.setdefault(lvl, {
-            "empathy": {"sum": 0, "n": 0},
-            "structure": {"sum": 0, "n": 0},
-            "alliance": {"sum": 0, "n": 0},
-        })
-        add_score(by_level[lvl], "empathy", scores.get("empathy"))
-        add_score(by_level[lvl], "structure", scores.get("structure"))
-        add_score(by_level[lvl], "alliance", scores.get("alliance"))
-
-        # by session_number
-        sn = None
-        srow = sess_map.get(sid)
-        if srow:
-            sn = srow.get("session_number")
-        if sn:
-            by_session.setdefault(str(sn), {
-                "empathy": {"sum": 0, "n": 0},
-                "structure": {"sum": 0, "n": 0},
-                "alliance": {"sum": 0, "n": 0},
-            })
-            add_score(by_session[str(sn)], "empathy", scores.get("empathy"))
-            add_score(by_session[str(sn)], "structure", scores.get("structure"))
-            add_score(by_session[str(sn)], "alliance", scores.get("alliance"))
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        # spawn, not fork: forking this threaded process can copy a held lock into the child
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=settings.PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pdf_pool
+
+# PostgREST caps rows per response (1000 on Supabase): page profiles by that,
+# and load sessions/feedback for this many students per request (16 sessions each)
+PROFILES_PAGE = 1000
+COHORT_BATCH = 50
+
+
+@app.get("/admin/cohort/summary-pdfs.zip")
+async def admin_cohort_summary_pdfs(level: Optional[str] = None, admin=Depends(require_admin)):
+    """Summary PDFs of every student (optionally one academic year) with sessions, as one ZIP."""
+    profs = []
+    while True:
+        q = supabase.table("profiles").select("user_id,level,email").eq("role", "student")
+        if level is not None:
+            q = q.eq("level", level)
+        page = (await q.order("created_at").range(len(profs), len(profs) + PROFILES_PAGE - 1).execute()).data or []
+        profs += page
+        if len(page) < PROFILES_PAGE:
+            break
+    if not profs:
+        raise HTTPException(404, "No students")
+
+    async def load_batch(ids: list):
+        return await asyncio.gather(
+            supabase.table("sessions")
+            .select("user_id,id,session_number,ended_at,difficulty")
+            .in_("user_id", ids)
+            .order("session_number")
+            .execute(),
+            supabase.table("feedback")
+            .select("user_id,session_id,internal_scores,skill_indicators_mask")
+            .in_("user_id", ids)
+            .execute(),
+        )
+
+    ids = [p["user_id"] for p in profs]
+    batches = await asyncio.gather(*(load_batch(ids[i:i + COHORT_BATCH]) for i in range(0, len(ids), COHORT_BATCH)))
+
+    sess_by_user, fb_by_user = {}, {}
+    for sess_resp, fb_resp in batches:
+        for s in sess_resp.data or []:
+            sess_by_user.setdefault(s["user_id"], []).append(s)
+        for f in fb_resp.data or []:
+            fb_by_user.setdefault(f["user_id"], []).append(f)
+
+    loop = asyncio.get_running_loop()
+    pool = _get_pdf_pool()
+
+    async def render(meta: dict, rows: list) -> bytes:
+        etag = _summary_pdf_etag(meta, rows)
+        pdf_bytes = _summary_pdf_cache.get(etag)
+        if pdf_bytes is None:
+            pdf_bytes = await loop.run_in_executor(pool, render_summary_pdf, SUMMARY_PDF_TITLE, meta, rows)
+            _summary_pdf_cache[etag] = pdf_bytes
+        return pdf_bytes
+
+    # students without sessions are skipped, like the 404 of the single-student export
+    names, jobs = [], []
+    for p in profs:
+        sess_rows = sess_by_user.get(p["user_id"])
+        if sess_rows:
+            names.append(f"summary_{p['user_id']}.pdf")
+            jobs.append(render(*_summary_pdf_inputs(p["user_id"], sess_rows, fb_by_user.get(p["user_id"], []), p)))
+    pdfs = await asyncio.gather(*jobs)
+
+    buf = BytesIO()
+    # PDFs are already compressed: store them as-is
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        for name, pdf_bytes in zip(names, pdfs):
+            zf.writestr(name, pdf_bytes)
+    buf.seek(0)
+    return StreamingResponse(
+        iter(lambda: buf.read(PDF_CHUNK_SIZE), b""),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="summary-pdfs.zip"'},
+    )
+
+@app.get("/admin/analytics/summary")
+async def admin_analytics_summary(admin=Depends(require_admin)):
+    # overall / by level (4e/5e/autre) / by session_number (1..16) averages,
+    # precomputed in mv_analytics_summary (pg_cron refresh every 5 min), via admin_analytics_summary RPC
+    cached = _admin_cache.get("analytics_summary")
+    if cached is None:
+        cached = _admin_cache["analytics_summary"] = (await supabase.rpc("admin_analytics_summary").execute()).data
+    return cached
+
+
+# columns FeedbackAdminResponse is built from
+FEEDBACK_ADMIN_COLUMNS = "language,student_facing,internal_scores,skill_indicators,kpis"
 
-    return {
-        "overall_avg": finalize(overall),
-        "by_level_avg": {lvl: finalize(acc) for lvl, acc in by_level.items()},
-        "by_session_number_avg": {sn: finalize(acc) for sn, acc in by_session.items()},
-    }
 @app.get("/admin/sessions/{session_id}/feedback", response_model=FeedbackAdminResponse)
-def admin_session_feedback(session_id: str, admin=Depends(require_admin)):
+async def admin_session_feedback(session_id: str, admin=Depends(require_admin)):
     resp = (
-        supabase.table("feedback")
-        .select("*")
+        await supabase.table("feedback")
+        .select(FEEDBACK_ADMIN_COLUMNS)
         .eq("session_id", session_id)
         .limit(1)
         .execute()
@@ -691,10 +866,10 @@ def admin_session_feedback(session_id: str, admin=Depends(require_admin)):
 )
 
 @app.get("/admin/feedback", response_model=List[FeedbackAdminResponse])
-def admin_all_feedback(admin=Depends(require_admin)):
+async def admin_all_feedback(admin=Depends(require_admin)):
     resp = (
-        supabase.table("feedback")
-        .select("*")
+        await supabase.table("feedback")
+        .select(FEEDBACK_ADMIN_COLUMNS)
         .order("created_at", desc=True)  # kalau ada kolom created_at
         .execute()
     )
@@ -713,10 +888,10 @@ def admin_all_feedback(admin=Depends(require_admin)):
     ]
 
 @app.get("/admin/students/{user_id}/feedback", response_model=List[FeedbackAdminResponse])
-def admin_student_feedback(user_id: str, admin=Depends(require_admin)):
+async def admin_student_feedback(user_id: str, admin=Depends(require_admin)):
     resp = (
-        supabase.table("feedback")
-        .select("*")
+        await supabase.table("feedback")
+        .select(FEEDBACK_ADMIN_COLUMNS)
         .eq("user_id", user_id)
         .order("created_at", desc=True)
         .execute()
@@ -1,30 +1,48 @@
 from __future__ import annotations
 from pydantic import BaseModel, EmailStr
-from pydantic import BaseModel, Field
-from typing import List, Literal, Dict, Any
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Literal, Dict, Any, Optional
 
 Language = Literal["fr", "en"]
 
-class StudentFacingFeedback(BaseModel):
+class _FeedbackModel(BaseModel):
+    # feedback is validated from LLM output / DB rows and never mutated:
+    # stray keys are dropped (pydantic's default, kept explicit) and instances are frozen
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+class StudentFacingFeedback(_FeedbackModel):
     strengths: List[str] = Field(min_length=3, max_length=5)
     areas_to_improve: List[str] = Field(min_length=3, max_length=5)
     reflective_question: str = Field(min_length=10, max_length=400)
 
-class SkillIndicators(BaseModel):
+class InternalScores(_FeedbackModel):
+    """empathy/structure/alliance (1..5), required from the eval model"""
+    empathy: int
+    structure: int
+    alliance: int
+
+class StoredInternalScores(_FeedbackModel):
+    """InternalScores as read back from the DB: older rows may miss a key (None)"""
+    empathy: Optional[int] = None
+    structure: Optional[int] = None
+    alliance: Optional[int] = None
+
+class SkillIndicators(_FeedbackModel):
     active_listening: bool
     reformulation: bool
     emotional_validation: bool
     open_questions: bool
     structure_clarity: bool
 
-class FeedbackSchema(BaseModel):
+class FeedbackSchema(_FeedbackModel):
+    """Structured output expected from the eval model (generate-feedback)."""
     language: Language
     student_facing: StudentFacingFeedback
-    internal_scores: Dict[str, int]          # empathy/structure/alliance
-    skill_indicators: Dict[str, bool]        # active_listening/reformulation/therapeutic_alliance
+    internal_scores: InternalScores
+    skill_indicators: SkillIndicators
     kpis: Dict[str, Any]
 
-class FeedbackStudentResponse(BaseModel):
+class FeedbackStudentResponse(_FeedbackModel):
     """
     Student-facing API response:
     - allowed: student_facing + internal_scores (shown as 'indicators', not grades)
@@ -32,15 +50,15 @@ class FeedbackStudentResponse(BaseModel):
     """
     language: Language
     student_facing: StudentFacingFeedback
-    internal_scores: Dict[str, int]  # empathy/structure/alliance (1..5)
+    internal_scores: StoredInternalScores
 
-class FeedbackAdminResponse(BaseModel):
+class FeedbackAdminResponse(_FeedbackModel):
     """
     Admin-facing API response includes all internal data.
     """
     language: Language
     student_facing: StudentFacingFeedback
-    internal_scores: Dict[str, int]
+    internal_scores: StoredInternalScores
     skill_indicators: SkillIndicators
     kpis: Dict[str, Any]
 
@@ -68,18 +86,6 @@ class EndSessionResponse(BaseModel):
     session_id: str
     status: str
 
-class StudentFacingFeedback(BaseModel):
-    strengths: List[str] = Field(min_length=3, max_length=5)
-    areas_to_improve: List[str] = Field(min_length=3, max_length=5)
-    reflective_question: str = Field(min_length=10, max_length=400)
-
-class FeedbackSchema(BaseModel):
-    language: Language
-    student_facing: StudentFacingFeedback
-    internal_scores: Dict[str, int]  # empathy/structure/alliance 1-5
-    skill_indicators: Dict[str, bool]
-    kpis: Dict[str, Any]
-
 class QuestionnaireSubmit(BaseModel):
     q1: int = Field(ge=1, le=5)
     q2: int = Field(ge=1, le=5)
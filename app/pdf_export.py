@@ -1,78 +1,79 @@
 from io import BytesIO
+from typing import BinaryIO
+from xml.sax.saxutils import escape
 from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-
-def build_session_pdf(title: str, meta: dict, feedback: dict, transcript: list) -> bytes:
-    buf = BytesIO()
-    c = canvas.Canvas(buf, pagesize=A4)
-    width, height = A4
-
-    y = height - 40
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(40, y, title)
-    y -= 24
-
-    c.setFont("Helvetica", 10)
-    for k, v in meta.items():
-        c.drawString(40, y, f"{k}: {v}")
-        y -= 14
-
-    y -= 10
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(40, y, "Feedback (student-facing)")
-    y -= 18
-    c.setFont("Helvetica", 10)
-
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+# paragraph styles, built once (same fonts/sizes as the old canvas layout)
+TITLE_STYLE = ParagraphStyle("Title", fontName="Helvetica-Bold", fontSize=14, leading=18, spaceAfter=8)
+META_STYLE = ParagraphStyle("Meta", fontName="Helvetica", fontSize=10, leading=14)
+HEADING_STYLE = ParagraphStyle("Heading", fontName="Helvetica-Bold", fontSize=12, leading=16, spaceBefore=10, spaceAfter=4)
+BODY_STYLE = ParagraphStyle("Body", fontName="Helvetica", fontSize=10, leading=14)
+ITEM_STYLE = ParagraphStyle("Item", parent=BODY_STYLE, leftIndent=20)
+SMALL_STYLE = ParagraphStyle("Small", fontName="Helvetica", fontSize=9, leading=12)
+# hanging indent: the session line at the margin, scores/skills lines indented
+SUMMARY_ROW_STYLE = ParagraphStyle("SummaryRow", parent=SMALL_STYLE, leftIndent=10, firstLineIndent=-10)
+SUMMARY_TABLE_STYLE = TableStyle([
+    ("LEFTPADDING", (0, 0), (-1, -1), 0),
+    ("RIGHTPADDING", (0, 0), (-1, -1), 0),
+    ("TOPPADDING", (0, 0), (-1, -1), 0),
+    ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+])
+
+SUMMARY_ROW_TEMPLATE = (
+    "Session {session_number} | Date: {ended_at} | Level: {difficulty}<br/>"
+    "Scores: empathy={empathy} structure={structure} alliance={alliance}<br/>"
+    "Skills: AL={active_listening} REF={reformulation} EV={emotional_validation} "
+    "OQ={open_questions} SC={structure_clarity}"
+)
+
+
+class _Fields(dict):
+    # scores / skill indicators missing from older feedback render as None
+    def __missing__(self, key):
+        return None
+
+
+def _p(text, style: ParagraphStyle) -> Paragraph:
+    # Paragraph parses XML-ish markup: escape user/LLM text, keep its line breaks
+    return Paragraph(escape(str(text)).replace("\n", "<br/>"), style)
+
+
+def _doc(out: BinaryIO, title: str) -> SimpleDocTemplate:
+    return SimpleDocTemplate(
+        out, pagesize=A4, title=title,
+        leftMargin=40, rightMargin=40, topMargin=40, bottomMargin=40,
+    )
+
+
+def build_session_pdf(title: str, meta: dict, feedback: dict, transcript: list, out: BinaryIO) -> None:
+    """Render the session report into the binary file-like `out`."""
+    story = [_p(title, TITLE_STYLE)]
+    story += [_p(f"{k}: {v}", META_STYLE) for k, v in meta.items()]
+
+    story.append(_p("Feedback (student-facing)", HEADING_STYLE))
     sf = feedback.get("student_facing", {})
     for label, items in [("Strengths", sf.get("strengths", [])), ("Areas to improve", sf.get("areas_to_improve", []))]:
-        c.drawString(40, y, label + ":")
-        y -= 14
-        for it in items:
-            c.drawString(60, y, f"- {it[:110]}")
-            y -= 14
+        story.append(_p(label + ":", BODY_STYLE))
+        story += [_p(f"- {it}", ITEM_STYLE) for it in items]
 
     rq = sf.get("reflective_question", "")
     if rq:
-        y -= 6
-        c.drawString(40, y, "Reflective question:")
-        y -= 14
-        c.drawString(60, y, rq[:120])
-        y -= 18
-
-    y -= 6
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(40, y, "Transcript")
-    y -= 18
-    c.setFont("Helvetica", 9)
-
-    for m in transcript:
-        line = f"[{m['role']}] {m['content']}"
-        for chunk in _wrap(line, 120):
-            if y < 60:
-                c.showPage()
-                y = height - 40
-                c.setFont("Helvetica", 9)
-            c.drawString(40, y, chunk)
-            y -= 12
-
-    c.showPage()
-    c.save()
-    return buf.getvalue()
+        story.append(Spacer(1, 6))
+        story.append(_p("Reflective question:", BODY_STYLE))
+        story.append(_p(rq, ITEM_STYLE))
+
+    story.append(_p("Transcript", HEADING_STYLE))
+    story += [_p(f"[{m['role']}] {m['content']}", SMALL_STYLE) for m in transcript]
+
+    _doc(out, title).build(story)
 
-def _wrap(text: str, n: int):
-    out, cur = [], ""
-    for w in text.split():
-        if len(cur) + len(w) + 1 > n:
-            out.append(cur)
-            cur = w
-        else:
-            cur = (cur + " " + w).strip()
-    if cur:
-        out.append(cur)
-    return out
-
-def build_summary_pdf(title: str, meta: dict, rows: list) -> bytes:
+
+def build_summary_pdf(title: str, meta: dict, rows: list, out: BinaryIO) -> None:
     """
+    Render the 16-session summary into the binary file-like `out`.
+
     rows: list of dicts with keys:
       - session_number
       - ended_at (str)
@@ -80,66 +81,30 @@ def build_summary_pdf(title: str, meta: dict, rows: list) -> bytes:
       - internal_scores (dict)
       - skill_indicators (dict)
     """
-    buf = BytesIO()
-    c = canvas.Canvas(buf, pagesize=A4)
-    width, height = A4
+    story = [_p(title, TITLE_STYLE)]
+    story += [_p(f"{k}: {v}", META_STYLE) for k, v in meta.items()]
+    story.append(_p("Résumé des 16 sessions", HEADING_STYLE))
 
-    y = height - 40
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(40, y, title)
-    y -= 24
+    data = []
+    for r in rows:
+        fields = _Fields(
+            r.get("skill_indicators") or {},
+            **(r.get("internal_scores") or {}),
+            session_number=r.get("session_number"),
+            ended_at=escape(str(r.get("ended_at") or "")[:19]),
+            difficulty=escape(str(r.get("difficulty"))),
+        )
+        data.append([Paragraph(SUMMARY_ROW_TEMPLATE.format_map(fields), SUMMARY_ROW_STYLE)])
 
-    c.setFont("Helvetica", 10)
-    for k, v in meta.items():
-        c.drawString(40, y, f"{k}: {v}")
-        y -= 14
+    # one row per session: a table row never splits across pages
+    if data:
+        story.append(Table(data, colWidths=[A4[0] - 80], style=SUMMARY_TABLE_STYLE))
 
-    y -= 10
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(40, y, "Résumé des 16 sessions")
-    y -= 18
-    c.setFont("Helvetica", 9)
+    _doc(out, title).build(story)
 
-    for r in rows:
-        line1 = f"Session {r.get('session_number')} | Date: {str(r.get('ended_at') or '')[:19]} | Level: {r.get('difficulty')}"
-        scores = r.get("internal_scores") or {}
-        si = r.get("skill_indicators") or {}
-        line2 = f"Scores: empathy={scores.get('empathy')} structure={scores.get('structure')} alliance={scores.get('alliance')}"
-        line3 = (
-            f"Skills: AL={si.get('active_listening')} "
-            f"REF={si.get('reformulation')} "
-            f"EV={si.get('emotional_validation')} "
-            f"OQ={si.get('open_questions')} "
-            f"SC={si.get('structure_clarity')}"
-        )
 
-        for chunk in _wrap(line1, 120):
-            if y < 70:
-                c.showPage()
-                y = height - 40
-                c.setFont("Helvetica", 9)
-            c.drawString(40, y, chunk)
-            y -= 12
-
-        for chunk in _wrap(line2, 120):
-            if y < 70:
-                c.showPage()
-                y = height - 40
-                c.setFont("Helvetica", 9)
-            c.drawString(50, y, chunk)
-            y -= 12
-
-        for chunk in _wrap(line3, 120):
-            if y < 70:
-                c.showPage()
-                y = height - 40
-                c.setFont("Helvetica", 9)
-            c.drawString(50, y, chunk)
-            y -= 12
-
-        y -= 6
-
-    c.showPage()
-    c.save()
+def render_summary_pdf(title: str, meta: dict, rows: list) -> bytes:
+    """build_summary_pdf into a fresh buffer (picklable entry point for process pools)."""
+    buf = BytesIO()
+    build_summary_pdf(title, meta, rows, buf)
     return buf.getvalue()
-
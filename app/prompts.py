@@ -100,3 +100,51 @@ FAIL-SAFE:
 - In that case: generic but actionable 3 strengths + 3 improvements, neutral scores=3, all indicators=false, kpis={} .
 """
 
+
+
+PATIENT_SYSTEMS = {"fr": PATIENT_SYSTEM_FR, "en": PATIENT_SYSTEM_EN}
+EVAL_SYSTEMS = {"fr": EVAL_SYSTEM_FR, "en": EVAL_SYSTEM_EN}
+
+# Per-request user prompts, filled with str.format_map.
+# {ctx} is compact JSON so the prefix stays byte-stable across turns.
+
+PATIENT_OPENING_TEMPLATE = """
+CONTEXTE (JSON):
+{ctx}
+
+INSTRUCTION:
+Tu es le PATIENT. Commence la consultation de manière naturelle et humaine.
+1 à 3 phrases. Pas de diagnostic, pas de pathologie, pas de phrases génériques.
+"""
+
+PATIENT_TURN_TEMPLATE = """
+CONTEXTE (JSON):
+{ctx}
+
+HISTORIQUE:
+{history}
+
+INSTRUCTION:
+Réponds uniquement comme le PATIENT. Réponse naturelle, courte à moyenne (1-5 phrases).
+"""
+
+EVAL_TEMPLATE = """
+Tu vas analyser une anamnèse (sans diagnostic). Tu dois produire STRICTEMENT du JSON suivant le schéma.
+Langue attendue: {lang}.
+
+METADATA:
+- session_number: {session_number}
+- patient_age: {patient_age}
+- patient_gender: {patient_gender}
+- difficulty(hidden): {difficulty}
+- reorientation: {reorientation}
+
+TRANSCRIPT:
+{transcript}
+
+CONTRAINTES JSON:
+- internal_scores: empathy/structure/alliance entiers 1..5
+- student_facing: strengths 3..5, areas_to_improve 3..5, reflective_question 1
+- skill_indicators booleans: active_listening, reformulation, emotional_validation, open_questions, structure_clarity
+- kpis: peux inclure open_questions_ratio (0..1), interruptions_estimate (int), etc.
+"""
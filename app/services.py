@@ -1,10 +1,14 @@
 from __future__ import annotations
 
-from datetime import datetime, timezone, timedelta
-import random
+import asyncio
+from datetime import date, datetime, timezone, timedelta
+from functools import lru_cache
+import weakref
 from typing import Any, Dict, List, Optional, Tuple
 from .models import SkillIndicators
+from cachetools import TTLCache
 from fastapi import HTTPException
+from postgrest.types import ReturnMethod
 from .db import supabase
 
 
@@ -16,31 +20,31 @@ def _now() -> datetime:
     return datetime.now(timezone.utc)
 
 
+@lru_cache(maxsize=64)
+def _week_start_of_day(day: int) -> datetime:
+    # day: proleptic ordinal of a UTC date; every call in the same week shares the result
+    d = date.fromordinal(day)
+    return datetime(d.year, d.month, d.day, tzinfo=timezone.utc) - timedelta(days=d.weekday())
+
+
 def iso_week_start(dt: datetime) -> datetime:
     """Monday 00:00 UTC for the week containing dt."""
-    d = dt.astimezone(timezone.utc)
-    return d - timedelta(
-        days=d.weekday(),
-        hours=d.hour,
-        minutes=d.minute,
-        seconds=d.second,
-        microseconds=d.microsecond,
-    )
+    return _week_start_of_day(dt.astimezone(timezone.utc).toordinal())
 
 
 def _raise_http(msg: str, status: int = 500):
     raise HTTPException(status_code=status, detail=msg)
 
 
-def _exec(fn, msg: str):
+async def _exec(fn, msg: str):
     """
-    Execute a supabase call and raise a readable HTTPException.
+    Await a supabase call and raise a readable HTTPException.
 
     - Postgrest API errors often contain useful dict fields (code/message).
     - We forward them as 400 by default because they're usually request/schema issues.
     """
     try:
-        return fn()
+        return await fn()
     except HTTPException:
         raise
     except Exception as e:
@@ -59,7 +63,11 @@ def _exec(fn, msg: str):
         _raise_http(f"{msg}: {type(e).__name__}: {e}", status=500)
 
 
-def _select_rows(
+# filter op -> postgrest query builder method
+_FILTER_METHODS = {"eq": "eq", "gte": "gte", "gt": "gt", "lte": "lte", "lt": "lt", "in": "in_"}
+
+
+async def _select_rows(
     table: str,
     select: str = "*",
     *,
@@ -71,22 +79,14 @@ def _select_rows(
     """
     Robust select returning a list of rows.
     """
-    def run():
+    async def run():
         q = supabase.table(table).select(select)
         if filters:
             for op, col, val in filters:
-                if op == "eq":
-                    q = q.eq(col, val)
-                elif op == "gte":
-                    q = q.gte(col, val)
-                elif op == "gt":
-                    q = q.gt(col, val)
-                elif op == "lte":
-                    q = q.lte(col, val)
-                elif op == "lt":
-                    q = q.lt(col, val)
-                else:
+                method = _FILTER_METHODS.get(op)
+                if method is None:
                     raise ValueError(f"Unsupported filter op: {op}")
+                q = getattr(q, method)(col, val)
         if or_:
             q = q.or_(or_)
         if order:
@@ -94,13 +94,13 @@ def _select_rows(
             q = q.order(col, desc=desc)
         if limit is not None:
             q = q.limit(limit)
-        return q.execute()
+        return await q.execute()
 
-    resp = _exec(run, f"{table} select failed")
+    resp = await _exec(run, f"{table} select failed")
     return getattr(resp, "data", None) or []
 
 
-def _select_first(
+async def _select_first(
     table: str,
     select: str = "*",
     *,
@@ -108,193 +108,107 @@ def _select_first(
     or_: Optional[str] = None,
     order: Optional[Tuple[str, bool]] = None,
 ) -> Optional[Row]:
-    rows = _select_rows(table, select, filters=filters, or_=or_, order=order, limit=1)
+    rows = await _select_rows(table, select, filters=filters, or_=or_, order=order, limit=1)
     return rows[0] if rows else None
 
 
-def sessions_completed_this_week(user_id: str) -> int:
-    start = iso_week_start(_now())
-    end = start + timedelta(days=7)
+WEEKLY_SESSION_LIMIT = 2
 
-    def run():
-        return (
-            supabase.table("sessions")
-            .select("id", count="exact")
-            .eq("user_id", user_id)
-            .eq("status", "completed")
-            .gte("ended_at", start.isoformat())
-            .lt("ended_at", end.isoformat())
-            .execute()
-        )
+# (user_id, week start) -> completed sessions that week; only end_session changes it
+_week_counts: TTLCache = TTLCache(maxsize=10_000, ttl=60)
 
-    res = _exec(run, "sessions_completed_this_week query failed")
-    return getattr(res, "count", None) or 0
 
+async def sessions_completed_this_week(user_id: str) -> int:
+    start = iso_week_start(_now())
 
-def ensure_user_program(user_id: str) -> None:
-    prog = _select_first(
-        "student_program",
-        "*",
-        filters=[("eq", "user_id", user_id)],
+    cached = _week_counts.get((user_id, start))
+    if cached is not None:
+        return cached
+
+    # trigger-maintained counter (user_weekly_progress migration)
+    row = await _select_first(
+        "user_weekly_progress",
+        "completed",
+        filters=[("eq", "user_id", user_id), ("eq", "week_start", start.date().isoformat())],
     )
-    if prog:
-        return
+    count = (row or {}).get("completed") or 0
+    _week_counts[(user_id, start)] = count
+    return count
 
-    # pick 2 immediate + 2 delayed among sessions 2..16 (avoid session 1)
-    all_sessions = list(range(2, 17))
-    random.shuffle(all_sessions)
-    immediate = sorted(all_sessions[:2])
-    delayed = sorted(all_sessions[2:4])
-
-    def run_insert():
-        return (
-            supabase.table("student_program")
-            .insert(
-                {
-                    "user_id": user_id,
-                    "reorientation_immediate_sessions": immediate,
-                    "reorientation_delayed_sessions": delayed,
-                }
-            )
-            .execute()
-        )
 
-    _exec(run_insert, "student_program insert failed")
+def invalidate_week_count(user_id: str) -> None:
+    _week_counts.pop((user_id, iso_week_start(_now())), None)
 
 
-def ensure_16_sessions_seeded(user_id: str) -> None:
-    ensure_user_program(user_id)
+# user_ids whose 16 sessions are known to exist; seeding is one-shot per user.
+# Bounded + expiring so a long-lived worker doesn't keep every user id forever.
+_seeded_users: TTLCache = TTLCache(maxsize=10_000, ttl=600)
 
-    existing_rows = _select_rows(
-        "sessions",
-        "session_number",
-        filters=[("eq", "user_id", user_id)],
-    )
-    existing_nums = {r["session_number"] for r in existing_rows if "session_number" in r}
 
-    if len(existing_nums) == 16:
+async def ensure_16_sessions_seeded(user_id: str) -> None:
+    """
+    Make sure the user has a student_program and sessions 1..16.
+    Program, difficulty chain and inserts all happen in the seed_sessions_for_user RPC.
+    """
+    if user_id in _seeded_users:
         return
 
-    prog = _select_first(
-        "student_program",
-        "*",
-        filters=[("eq", "user_id", user_id)],
-    )
-    if not prog:
-        _raise_http("student_program missing after ensure_user_program", status=500)
-
-    immediate = set(prog.get("reorientation_immediate_sessions") or [])
-    delayed = set(prog.get("reorientation_delayed_sessions") or [])
-
-    # difficulty assignment: session1 L1, others randomized with no consecutive repetition
-    diffs: List[str] = []
-    prev: Optional[str] = None
-    for sn in range(1, 17):
-        if sn == 1:
-            d = "L1"
-        else:
-            choices = ["L1", "L2", "L3"]
-            if prev in choices:
-                choices.remove(prev)
-            d = random.choice(choices)
-        diffs.append(d)
-        prev = d
-
-    rows_to_insert: List[Row] = []
-    for sn in range(1, 17):
-        if sn in existing_nums:
-            continue
-
-        reor = "none"
-        if sn in immediate:
-            reor = "immediate"
-        elif sn in delayed:
-            reor = "delayed"
-
-        age = random.choice([12, 15, 18, 24, 32, 41, 52, 67, 74])
-        gender = random.choice(["female", "male"])
-        patient_starts = random.choice([True, False])
-
-        status = "available" if sn == 1 else "locked"
-
-        rows_to_insert.append(
-            {
-                "user_id": user_id,
-                "session_number": sn,
-                "status": status,
-                "difficulty": diffs[sn - 1],
-                "reorientation": reor,
-                "patient_age": age,
-                "patient_gender": gender,
-                "patient_opening_starts": patient_starts,
-            }
-        )
-
-    if rows_to_insert:
-        def run_insert_sessions():
-            return supabase.table("sessions").insert(rows_to_insert).execute()
+    async def run():
+        return await supabase.rpc("seed_sessions_for_user", {"p_user_id": user_id}).execute()
 
-        _exec(run_insert_sessions, "sessions seed insert failed")
+    await _exec(run, "sessions seed failed")
+    _seeded_users[user_id] = True
 
 
-def get_available_session(user_id: str) -> Optional[Row]:
-    ensure_16_sessions_seeded(user_id)
+async def get_available_session(user_id: str) -> Optional[Row]:
+    await ensure_16_sessions_seeded(user_id)
 
-    # status == in_progress OR available (PostgREST OR filter string)
-    return _select_first(
+    # status in (in_progress, available): served by sessions_user_active_idx
+    return await _select_first(
         "sessions",
         "*",
-        filters=[("eq", "user_id", user_id)],
-        or_="status.eq.in_progress,status.eq.available",
+        filters=[("eq", "user_id", user_id), ("in", "status", ["in_progress", "available"])],
         order=("session_number", False),
     )
 
 
-def lock_and_unlock_next(user_id: str, session_number: int) -> None:
+async def lock_and_unlock_next(user_id: str, session_number: int) -> None:
     if session_number >= 16:
         return
     next_num = session_number + 1
 
-    def run():
-        return (
+    async def run():
+        return await (
             supabase.table("sessions")
-            .update({"status": "available"})
+            .update({"status": "available"}, returning=ReturnMethod.minimal)
             .eq("user_id", user_id)
             .eq("session_number", next_num)
             .eq("status", "locked")
             .execute()
         )
 
-    _exec(run, "unlock next session failed")
+    await _exec(run, "unlock next session failed")
 
 
-def gender_label(age: int, gender: str, lang: str) -> str:
-    if lang == "en":
-        if age < 17:
-            return "Girl" if gender == "female" else "Boy"
-        return "Woman" if gender == "female" else "Man"
-
-    # fr
-    if age < 17:
-        return "Fille" if gender == "female" else "Garçon"
-    return "Femme" if gender == "female" else "Homme"
+# (lang, adult, female) -> label; languages other than "en" get the French labels
+_GENDER_LABELS = {
+    ("en", False, True): "Girl",
+    ("en", False, False): "Boy",
+    ("en", True, True): "Woman",
+    ("en", True, False): "Man",
+    ("fr", False, True): "Fille",
+    ("fr", False, False): "Garçon",
+    ("fr", True, True): "Femme",
+    ("fr", True, False): "Homme",
+}
 
 
-def next_turn_index(session_id: str) -> int:
-    rows = _select_rows(
-        "messages",
-        "turn_index",
-        filters=[("eq", "session_id", session_id)],
-        order=("turn_index", True),
-        limit=1,
-    )
-    if not rows:
-        return 1
-    return int(rows[0]["turn_index"]) + 1
+def gender_label(age: int, gender: str, lang: str) -> str:
+    return _GENDER_LABELS[("en" if lang == "en" else "fr", age >= 17, gender == "female")]
 
 
-def get_history(session_id: str, limit: int) -> List[Row]:
-    rows = _select_rows(
+async def get_history(session_id: str, limit: int) -> List[Row]:
+    rows = await _select_rows(
         "messages",
         "role,content,turn_index",
         filters=[("eq", "session_id", session_id)],
@@ -303,6 +217,40 @@ def get_history(session_id: str, limit: int) -> List[Row]:
     )
     return list(reversed(rows))
 
+
+# session_id -> latest turns (chronological). Filled on the first chat turn and
+# extended by chat_send after each write, so later turns skip the history SELECT.
+# In-process only: assumes one app process serves a given session.
+_history_cache: TTLCache = TTLCache(maxsize=2_000, ttl=3600)
+# session_id -> lock serializing chat turns of that session (dropped when unused)
+_session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def session_lock(session_id: str) -> asyncio.Lock:
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _session_locks[session_id] = lock
+    return lock
+
+
+async def get_recent_history(session_id: str, limit: int) -> List[Row]:
+    cached = _history_cache.get(session_id)
+    if cached is None:
+        cached = await get_history(session_id, limit)
+        _history_cache[session_id] = cached
+    return cached[-limit:]
+
+
+def append_history(session_id: str, rows: List[Row], limit: int) -> None:
+    cached = _history_cache.get(session_id)
+    if cached is not None:
+        _history_cache[session_id] = (cached + rows)[-limit:]
+
+
+def invalidate_history(session_id: str) -> None:
+    _history_cache.pop(session_id, None)
+
 # ===== BADGES =====
 
 MILESTONE_BADGES: Dict[int, str] = {
@@ -321,52 +269,53 @@ SKILL_BADGES: Dict[str, str] = {
     "structure_clarity": "SKILL_STRUCTURE_CLARITY",
 }
 
-def award_badge(user_id: str, badge_code: str) -> None:
-    existing = (
-        supabase.table("badges")
-        .select("id")
-        .eq("user_id", user_id)
-        .eq("badge_code", badge_code)
-        .maybe_single()
-        .execute()
-    )
-    if existing and existing.data:
+# bit k of feedback.skill_indicators_mask is SKILL_KEYS[k] (see the
+# feedback_skill_indicators_mask migration)
+SKILL_KEYS: Tuple[str, ...] = tuple(SkillIndicators.model_fields)
+
+
+def skill_indicators_from_mask(mask: Optional[int]) -> Dict[str, bool]:
+    if mask is None:
+        return {}
+    return {k: bool(mask >> i & 1) for i, k in enumerate(SKILL_KEYS)}
+
+
+async def award_badges(user_id: str, badge_codes: List[str]) -> None:
+    """
+    Award several badges in one request. Idempotent: already-awarded badges are
+    skipped by the (user_id, badge_code) unique index.
+    """
+    if not badge_codes:
         return
+    await supabase.table("badges").upsert(
+        [{"user_id": user_id, "badge_code": code} for code in badge_codes],
+        on_conflict="user_id,badge_code",
+        ignore_duplicates=True,
+        returning=ReturnMethod.minimal,
+    ).execute()
 
-    supabase.table("badges").insert({
-        "user_id": user_id,
-        "badge_code": badge_code,
-    }).execute()
+async def award_badge(user_id: str, badge_code: str) -> None:
+    await award_badges(user_id, [badge_code])
 
-def award_milestone_badge(user_id: str, session_number: int) -> None:
+async def award_milestone_badge(user_id: str, session_number: int) -> None:
     code = MILESTONE_BADGES.get(session_number)
     if not code:
         return
-    award_badge(user_id, code)
+    await award_badge(user_id, code)
 
-def award_skill_badges_if_ready(user_id: str, threshold: int = 3) -> None:
+async def award_skill_badges_if_ready(user_id: str, threshold: int = 3) -> None:
     """
     Award skill badges if the student has skill=True in >= threshold feedback sessions.
     This avoids random 1-session badges and is stable for MVP.
     """
-    rows = (
-        supabase.table("feedback")
-        .select("skill_indicators")
-        .eq("user_id", user_id)
-        .execute()
-    ).data or []
-
-    counts = {k: 0 for k in SKILL_BADGES.keys()}
-
-    for r in rows:
-        si = r.get("skill_indicators") or {}
-        for k in counts:
-            if si.get(k) is True:
-                counts[k] += 1
-
-    for skill_key, badge_code in SKILL_BADGES.items():
-        if counts.get(skill_key, 0) >= threshold:
-            award_badge(user_id, badge_code)
+    # counted in Postgres (count_skill_hits RPC): one row, skill -> sessions
+    rows = (await supabase.rpc("count_skill_hits", {"p_user_id": user_id}).execute()).data or []
+    counts = rows[0] if rows else {}
+
+    await award_badges(user_id, [
+        badge_code for skill_key, badge_code in SKILL_BADGES.items()
+        if counts.get(skill_key, 0) >= threshold
+    ])
 
 def normalize_skill_indicators(raw: dict) -> SkillIndicators:
     """
@@ -0,0 +1,17 @@
+-- Single round-trip profile bootstrap used by app/auth.py (get_current_user).
+-- Creates the profiles row on first login with the same defaults the API
+-- used to insert, refreshes email on later logins, and returns the row.
+
+create or replace function public.ensure_profile(uid uuid, em text)
+returns public.profiles
+language sql
+as $$
+    insert into public.profiles (user_id, email, role, level, preferred_language)
+    values (uid, em, 'student', 'autre', 'fr')
+    on conflict (user_id) do update
+        set email = coalesce(excluded.email, public.profiles.email)
+    returning *;
+$$;
+
+revoke all on function public.ensure_profile(uuid, text) from public, anon, authenticated;
+grant execute on function public.ensure_profile(uuid, text) to service_role;
@@ -0,0 +1,32 @@
+-- Write side of one chat turn (app/main.py chat_send) in a single call:
+-- flips the session available -> in_progress on the first turn and stores the
+-- turn's messages (optional patient opening, student message, patient reply).
+-- p_messages: [{"turn_index": int, "role": text, "content": text}, ...]
+
+create or replace function public.chat_send_tx(
+    p_session_id uuid,
+    p_user_id uuid,
+    p_start boolean,
+    p_messages jsonb
+)
+returns void
+language plpgsql
+as $$
+begin
+    if p_start then
+        update public.sessions
+           set status = 'in_progress',
+               started_at = coalesce(started_at, now())
+         where id = p_session_id
+           and user_id = p_user_id
+           and status = 'available';
+    end if;
+
+    insert into public.messages (session_id, user_id, turn_index, role, content)
+    select p_session_id, p_user_id, m.turn_index, m.role, m.content
+      from jsonb_populate_recordset(null::public.messages, p_messages) as m;
+end;
+$$;
+
+revoke all on function public.chat_send_tx(uuid, uuid, boolean, jsonb) from public, anon, authenticated;
+grant execute on function public.chat_send_tx(uuid, uuid, boolean, jsonb) to service_role;
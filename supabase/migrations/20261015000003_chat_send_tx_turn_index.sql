@@ -0,0 +1,43 @@
+-- chat_send_tx numbers the turn's messages itself: max(turn_index) + position
+-- in p_messages, read under a lock on the session row so concurrent turns of
+-- the same session can't hand out the same turn_index.
+-- p_messages: [{"role": text, "content": text}, ...] in conversation order
+
+create or replace function public.chat_send_tx(
+    p_session_id uuid,
+    p_user_id uuid,
+    p_start boolean,
+    p_messages jsonb
+)
+returns void
+language plpgsql
+as $$
+declare
+    v_last int;
+begin
+    perform 1
+       from public.sessions
+      where id = p_session_id
+        and user_id = p_user_id
+        for update;
+
+    if p_start then
+        update public.sessions
+           set status = 'in_progress',
+               started_at = coalesce(started_at, now())
+         where id = p_session_id
+           and user_id = p_user_id
+           and status = 'available';
+    end if;
+
+    select coalesce(max(turn_index), 0)
+      into v_last
+      from public.messages
+     where session_id = p_session_id;
+
+    insert into public.messages (session_id, user_id, turn_index, role, content)
+    select p_session_id, p_user_id, v_last + e.ord::int, m.role, m.content
+      from jsonb_array_elements(p_messages) with ordinality as e(msg, ord)
+     cross join lateral jsonb_populate_record(null::public.messages, e.msg) as m;
+end;
+$$;
@@ -0,0 +1,61 @@
+-- chat_send_tx also enforces the weekly session limit when it starts a session
+-- (available -> in_progress), under the same session row lock, so two
+-- concurrent first turns can't both pass the API's pre-check.
+-- Week = Monday 00:00 UTC, same as services.iso_week_start.
+
+drop function if exists public.chat_send_tx(uuid, uuid, boolean, jsonb);
+
+create or replace function public.chat_send_tx(
+    p_session_id uuid,
+    p_user_id uuid,
+    p_start boolean,
+    p_messages jsonb,
+    p_weekly_limit int default null
+)
+returns void
+language plpgsql
+as $$
+declare
+    v_last int;
+    v_week_start timestamptz := date_trunc('week', now() at time zone 'utc') at time zone 'utc';
+begin
+    perform 1
+       from public.sessions
+      where id = p_session_id
+        and user_id = p_user_id
+        for update;
+
+    if p_start then
+        if p_weekly_limit is not null and (
+            select count(*)
+              from public.sessions
+             where user_id = p_user_id
+               and status = 'completed'
+               and ended_at >= v_week_start
+               and ended_at < v_week_start + interval '7 days'
+        ) >= p_weekly_limit then
+            raise exception 'weekly_limit' using errcode = 'P0001';
+        end if;
+
+        update public.sessions
+           set status = 'in_progress',
+               started_at = coalesce(started_at, now())
+         where id = p_session_id
+           and user_id = p_user_id
+           and status = 'available';
+    end if;
+
+    select coalesce(max(turn_index), 0)
+      into v_last
+      from public.messages
+     where session_id = p_session_id;
+
+    insert into public.messages (session_id, user_id, turn_index, role, content)
+    select p_session_id, p_user_id, v_last + e.ord::int, m.role, m.content
+      from jsonb_array_elements(p_messages) with ordinality as e(msg, ord)
+     cross join lateral jsonb_populate_record(null::public.messages, e.msg) as m;
+end;
+$$;
+
+revoke all on function public.chat_send_tx(uuid, uuid, boolean, jsonb, int) from public, anon, authenticated;
+grant execute on function public.chat_send_tx(uuid, uuid, boolean, jsonb, int) to service_role;
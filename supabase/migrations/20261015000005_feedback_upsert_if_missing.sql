@@ -0,0 +1,37 @@
+-- One feedback row per session, written by app/main.py generate_feedback.
+-- feedback_upsert_if_missing stores p_feedback only if the session belongs to
+-- p_user_id and is completed; a concurrent duplicate is ignored and the stored
+-- row is returned either way (empty result = session not eligible).
+-- p_feedback: {"language", "student_facing", "internal_scores", "skill_indicators", "kpis"}
+
+create unique index if not exists feedback_session_id_key
+    on public.feedback (session_id);
+
+create or replace function public.feedback_upsert_if_missing(
+    p_session_id uuid,
+    p_user_id uuid,
+    p_feedback jsonb
+)
+returns setof public.feedback
+language plpgsql
+as $$
+begin
+    insert into public.feedback (session_id, user_id, language, student_facing, internal_scores, skill_indicators, kpis)
+    select s.id, s.user_id, f.language, f.student_facing, f.internal_scores, f.skill_indicators, f.kpis
+      from public.sessions s
+     cross join lateral jsonb_populate_record(null::public.feedback, p_feedback) as f
+     where s.id = p_session_id
+       and s.user_id = p_user_id
+       and s.status = 'completed'
+    on conflict (session_id) do nothing;
+
+    return query
+        select *
+          from public.feedback
+         where session_id = p_session_id
+           and user_id = p_user_id;
+end;
+$$;
+
+revoke all on function public.feedback_upsert_if_missing(uuid, uuid, jsonb) from public, anon, authenticated;
+grant execute on function public.feedback_upsert_if_missing(uuid, uuid, jsonb) to service_role;
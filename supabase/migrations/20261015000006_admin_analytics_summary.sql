@@ -0,0 +1,58 @@
+-- Admin analytics (GET /admin/analytics/summary) in one round-trip: averages of
+-- feedback.internal_scores overall, by profiles.level (missing -> 'autre') and
+-- by sessions.session_number, in the JSON shape the endpoint returns.
+
+create or replace function public.admin_analytics_summary()
+returns jsonb
+language sql
+stable
+as $$
+    with scores as (
+        select coalesce(nullif(p.level::text, ''), 'autre') as level,
+               s.session_number,
+               (f.internal_scores->>'empathy')::int as empathy,
+               (f.internal_scores->>'structure')::int as structure,
+               (f.internal_scores->>'alliance')::int as alliance
+          from public.feedback f
+          left join public.sessions s on s.id = f.session_id
+          left join public.profiles p on p.user_id = f.user_id
+    ),
+    overall as (
+        select jsonb_build_object(
+                   'empathy', avg(empathy)::float8,
+                   'structure', avg(structure)::float8,
+                   'alliance', avg(alliance)::float8
+               ) as avgs
+          from scores
+    ),
+    by_level as (
+        select level as key,
+               jsonb_build_object(
+                   'empathy', avg(empathy)::float8,
+                   'structure', avg(structure)::float8,
+                   'alliance', avg(alliance)::float8
+               ) as avgs
+          from scores
+         group by level
+    ),
+    by_session as (
+        select session_number::text as key,
+               jsonb_build_object(
+                   'empathy', avg(empathy)::float8,
+                   'structure', avg(structure)::float8,
+                   'alliance', avg(alliance)::float8
+               ) as avgs
+          from scores
+         where session_number is not null
+           and session_number <> 0
+         group by session_number
+    )
+    select jsonb_build_object(
+        'overall_avg', (select avgs from overall),
+        'by_level_avg', coalesce((select jsonb_object_agg(key, avgs) from by_level), '{}'::jsonb),
+        'by_session_number_avg', coalesce((select jsonb_object_agg(key, avgs) from by_session), '{}'::jsonb)
+    );
+$$;
+
+revoke all on function public.admin_analytics_summary() from public, anon, authenticated;
+grant execute on function public.admin_analytics_summary() to service_role;
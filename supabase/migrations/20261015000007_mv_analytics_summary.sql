@@ -0,0 +1,75 @@
+-- Admin analytics averages precomputed in a materialized view, refreshed every
+-- 5 minutes by pg_cron (the summary may lag new feedback by that much).
+-- One row per (scope, key): ('overall', 'all'), ('level', <level>),
+-- ('session', <session_number>). admin_analytics_summary() now just pivots it;
+-- the view itself is not exposed to anon/authenticated.
+
+create extension if not exists pg_cron;
+
+create materialized view if not exists public.mv_analytics_summary as
+    with scores as (
+        select coalesce(nullif(p.level::text, ''), 'autre') as level,
+               s.session_number,
+               (f.internal_scores->>'empathy')::int as empathy,
+               (f.internal_scores->>'structure')::int as structure,
+               (f.internal_scores->>'alliance')::int as alliance
+          from public.feedback f
+          left join public.sessions s on s.id = f.session_id
+          left join public.profiles p on p.user_id = f.user_id
+    )
+    select 'overall' as scope, 'all' as key,
+           avg(empathy)::float8 as avg_empathy,
+           avg(structure)::float8 as avg_structure,
+           avg(alliance)::float8 as avg_alliance
+      from scores
+    union all
+    select 'level', level,
+           avg(empathy)::float8, avg(structure)::float8, avg(alliance)::float8
+      from scores
+     group by level
+    union all
+    select 'session', session_number::text,
+           avg(empathy)::float8, avg(structure)::float8, avg(alliance)::float8
+      from scores
+     where session_number is not null
+       and session_number <> 0
+     group by session_number;
+
+-- required by refresh ... concurrently
+create unique index if not exists mv_analytics_summary_scope_key_idx
+    on public.mv_analytics_summary (scope, key);
+
+revoke all on public.mv_analytics_summary from public, anon, authenticated;
+
+select cron.schedule(
+    'refresh-mv-analytics-summary',
+    '*/5 * * * *',
+    $$refresh materialized view concurrently public.mv_analytics_summary$$
+);
+
+create or replace function public.admin_analytics_summary()
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'overall_avg', (
+            select jsonb_build_object('empathy', avg_empathy, 'structure', avg_structure, 'alliance', avg_alliance)
+              from public.mv_analytics_summary
+             where scope = 'overall'
+        ),
+        'by_level_avg', coalesce((
+            select jsonb_object_agg(key, jsonb_build_object('empathy', avg_empathy, 'structure', avg_structure, 'alliance', avg_alliance))
+              from public.mv_analytics_summary
+             where scope = 'level'
+        ), '{}'::jsonb),
+        'by_session_number_avg', coalesce((
+            select jsonb_object_agg(key, jsonb_build_object('empathy', avg_empathy, 'structure', avg_structure, 'alliance', avg_alliance))
+              from public.mv_analytics_summary
+             where scope = 'session'
+        ), '{}'::jsonb)
+    );
+$$;
+
+revoke all on function public.admin_analytics_summary() from public, anon, authenticated;
+grant execute on function public.admin_analytics_summary() to service_role;
@@ -0,0 +1,31 @@
+-- Everything GET /admin/sessions/{id}/pdf needs, in one round-trip:
+-- {"session", "feedback" (null if none yet), "level" (student's profiles.level),
+--  "messages": [{"role", "content", "turn_index"}, ...] ordered by turn_index}.
+-- Returns null when the session does not exist.
+
+create or replace function public.get_session_pdf_bundle(p_session_id uuid)
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'session', to_jsonb(s),
+        'feedback', to_jsonb(f),
+        'level', p.level,
+        'messages', coalesce((
+            select jsonb_agg(
+                       jsonb_build_object('role', m.role, 'content', m.content, 'turn_index', m.turn_index)
+                       order by m.turn_index
+                   )
+              from public.messages m
+             where m.session_id = s.id
+        ), '[]'::jsonb)
+    )
+      from public.sessions s
+      left join public.feedback f on f.session_id = s.id
+      left join public.profiles p on p.user_id = s.user_id
+     where s.id = p_session_id;
+$$;
+
+revoke all on function public.get_session_pdf_bundle(uuid) from public, anon, authenticated;
+grant execute on function public.get_session_pdf_bundle(uuid) to service_role;
@@ -0,0 +1,23 @@
+-- Indexes for the API's hot lookups. feedback (session_id) already exists
+-- (feedback_upsert_if_missing migration).
+-- Plain create index: migrations run inside a transaction, where
+-- "concurrently" is not allowed. On a large live table, run the same
+-- statements by hand with "concurrently" before applying this file.
+
+-- session by number (unlock next, seeding); unique: one row per student and
+-- session number, also the on conflict target of seed_sessions_for_user
+create unique index if not exists sessions_user_id_session_number_key
+    on public.sessions (user_id, session_number);
+
+-- transcript / recent history reads and max(turn_index) in chat_send_tx
+create index if not exists messages_session_id_turn_index_idx
+    on public.messages (session_id, turn_index);
+
+-- per-student feedback: summary PDF, skill badges, admin student feedback
+create index if not exists feedback_user_id_idx
+    on public.feedback (user_id);
+
+-- admin student listing: role = 'student' order by created_at desc, user_id desc
+create index if not exists profiles_students_created_at_idx
+    on public.profiles (created_at desc, user_id desc)
+    where role = 'student';
@@ -0,0 +1,38 @@
+-- get_session_pdf_bundle: return only the session / feedback columns the PDF
+-- uses instead of whole rows (skips kpis, transcript-sized jsonb etc.).
+
+create or replace function public.get_session_pdf_bundle(p_session_id uuid)
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'session', jsonb_build_object(
+            'user_id', s.user_id,
+            'session_number', s.session_number,
+            'ended_at', s.ended_at,
+            'difficulty', s.difficulty
+        ),
+        'feedback', case when f.session_id is null then null else jsonb_build_object(
+            'student_facing', f.student_facing,
+            'internal_scores', f.internal_scores,
+            'skill_indicators', f.skill_indicators
+        ) end,
+        'level', p.level,
+        'messages', coalesce((
+            select jsonb_agg(
+                       jsonb_build_object('role', m.role, 'content', m.content, 'turn_index', m.turn_index)
+                       order by m.turn_index
+                   )
+              from public.messages m
+             where m.session_id = s.id
+        ), '[]'::jsonb)
+    )
+      from public.sessions s
+      left join public.feedback f on f.session_id = s.id
+      left join public.profiles p on p.user_id = s.user_id
+     where s.id = p_session_id;
+$$;
+
+revoke all on function public.get_session_pdf_bundle(uuid) from public, anon, authenticated;
+grant execute on function public.get_session_pdf_bundle(uuid) to service_role;
@@ -0,0 +1,66 @@
+-- Dashboard counters for GET /admin/stats, kept exact by triggers instead of
+-- count(*) scans on every request:
+--   students           = profiles where role = 'student'
+--   sessions_completed = sessions where status = 'completed'
+
+create table if not exists public.counters (
+    key text primary key,
+    n bigint not null default 0
+);
+
+-- no policies: only the service role (API) reads it
+alter table public.counters enable row level security;
+
+create or replace function public.counters_students_trg()
+returns trigger
+language plpgsql
+as $$
+declare
+    d bigint := 0;
+begin
+    if tg_op in ('INSERT', 'UPDATE') and new.role = 'student' then
+        d := d + 1;
+    end if;
+    if tg_op in ('UPDATE', 'DELETE') and old.role = 'student' then
+        d := d - 1;
+    end if;
+    if d <> 0 then
+        update public.counters set n = n + d where key = 'students';
+    end if;
+    return null;
+end;
+$$;
+
+create or replace function public.counters_sessions_completed_trg()
+returns trigger
+language plpgsql
+as $$
+declare
+    d bigint := 0;
+begin
+    if tg_op in ('INSERT', 'UPDATE') and new.status = 'completed' then
+        d := d + 1;
+    end if;
+    if tg_op in ('UPDATE', 'DELETE') and old.status = 'completed' then
+        d := d - 1;
+    end if;
+    if d <> 0 then
+        update public.counters set n = n + d where key = 'sessions_completed';
+    end if;
+    return null;
+end;
+$$;
+
+create or replace trigger profiles_counters
+    after insert or delete or update of role on public.profiles
+    for each row execute function public.counters_students_trg();
+
+create or replace trigger sessions_counters
+    after insert or delete or update of status on public.sessions
+    for each row execute function public.counters_sessions_completed_trg();
+
+insert into public.counters (key, n)
+values
+    ('students', (select count(*) from public.profiles where role = 'student')),
+    ('sessions_completed', (select count(*) from public.sessions where status = 'completed'))
+on conflict (key) do update set n = excluded.n;
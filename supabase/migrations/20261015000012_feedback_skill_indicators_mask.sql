@@ -0,0 +1,16 @@
+-- feedback.skill_indicators as a smallint bitmask, kept in sync by Postgres
+-- (generated column: backfilled on add, recomputed on every write).
+-- Bit order matches SKILL_KEYS in app/services.py:
+--   0 active_listening, 1 reformulation, 2 emotional_validation,
+--   3 open_questions, 4 structure_clarity
+-- A skill counts only when its JSON value is true (missing = not set).
+
+alter table public.feedback
+    add column if not exists skill_indicators_mask smallint
+    generated always as ((
+          (case when skill_indicators->>'active_listening' = 'true' then 1 else 0 end)
+        | (case when skill_indicators->>'reformulation' = 'true' then 2 else 0 end)
+        | (case when skill_indicators->>'emotional_validation' = 'true' then 4 else 0 end)
+        | (case when skill_indicators->>'open_questions' = 'true' then 8 else 0 end)
+        | (case when skill_indicators->>'structure_clarity' = 'true' then 16 else 0 end)
+    )::smallint) stored;
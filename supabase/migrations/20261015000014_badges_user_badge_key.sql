@@ -0,0 +1,5 @@
+-- One row per (user, badge): conflict target for the idempotent badge upsert
+-- in app/services.py award_badge (on_conflict=user_id,badge_code).
+
+create unique index if not exists badges_user_id_badge_code_key
+    on public.badges (user_id, badge_code);
@@ -0,0 +1,26 @@
+-- Per-skill counts of a student's feedback sessions where the skill was shown,
+-- for app/services.py award_skill_badges_if_ready. One row, one column per
+-- skill (bits of feedback.skill_indicators_mask).
+
+create or replace function public.count_skill_hits(p_user_id uuid)
+returns table (
+    active_listening bigint,
+    reformulation bigint,
+    emotional_validation bigint,
+    open_questions bigint,
+    structure_clarity bigint
+)
+language sql
+stable
+as $$
+    select count(*) filter (where skill_indicators_mask & 1 <> 0),
+           count(*) filter (where skill_indicators_mask & 2 <> 0),
+           count(*) filter (where skill_indicators_mask & 4 <> 0),
+           count(*) filter (where skill_indicators_mask & 8 <> 0),
+           count(*) filter (where skill_indicators_mask & 16 <> 0)
+      from public.feedback
+     where user_id = p_user_id;
+$$;
+
+revoke all on function public.count_skill_hits(uuid) from public, anon, authenticated;
+grant execute on function public.count_skill_hits(uuid) to service_role;
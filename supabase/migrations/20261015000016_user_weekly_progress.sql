@@ -0,0 +1,101 @@
+-- Completed sessions per user and week, kept by a trigger on sessions, so the
+-- weekly limit is a point lookup instead of a count over sessions.
+-- Week = Monday 00:00 UTC of ended_at (same as services.iso_week_start);
+-- a session counts while status = 'completed' and ended_at is set.
+
+create table if not exists public.user_weekly_progress (
+    user_id uuid not null,
+    week_start date not null,
+    completed int not null default 0,
+    primary key (user_id, week_start)
+);
+
+-- no policies: only the service role (API) reads it
+alter table public.user_weekly_progress enable row level security;
+
+create or replace function public.user_weekly_progress_trg()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') and old.status = 'completed' and old.ended_at is not null then
+        update public.user_weekly_progress
+           set completed = completed - 1
+         where user_id = old.user_id
+           and week_start = date_trunc('week', old.ended_at at time zone 'utc')::date;
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') and new.status = 'completed' and new.ended_at is not null then
+        insert into public.user_weekly_progress (user_id, week_start, completed)
+        values (new.user_id, date_trunc('week', new.ended_at at time zone 'utc')::date, 1)
+        on conflict (user_id, week_start) do update
+            set completed = public.user_weekly_progress.completed + 1;
+    end if;
+    return null;
+end;
+$$;
+
+create or replace trigger sessions_user_weekly_progress
+    after insert or delete or update of status, ended_at, user_id on public.sessions
+    for each row execute function public.user_weekly_progress_trg();
+
+insert into public.user_weekly_progress (user_id, week_start, completed)
+select user_id, date_trunc('week', ended_at at time zone 'utc')::date, count(*)
+  from public.sessions
+ where status = 'completed'
+   and ended_at is not null
+ group by 1, 2
+on conflict (user_id, week_start) do update set completed = excluded.completed;
+
+-- chat_send_tx: same as before, weekly limit read from user_weekly_progress
+create or replace function public.chat_send_tx(
+    p_session_id uuid,
+    p_user_id uuid,
+    p_start boolean,
+    p_messages jsonb,
+    p_weekly_limit int default null
+)
+returns void
+language plpgsql
+as $$
+declare
+    v_last int;
+    v_week date := date_trunc('week', now() at time zone 'utc')::date;
+begin
+    perform 1
+       from public.sessions
+      where id = p_session_id
+        and user_id = p_user_id
+        for update;
+
+    if p_start then
+        if p_weekly_limit is not null and coalesce((
+            select completed
+              from public.user_weekly_progress
+             where user_id = p_user_id
+               and week_start = v_week
+        ), 0) >= p_weekly_limit then
+            raise exception 'weekly_limit' using errcode = 'P0001';
+        end if;
+
+        update public.sessions
+           set status = 'in_progress',
+               started_at = coalesce(started_at, now())
+         where id = p_session_id
+           and user_id = p_user_id
+           and status = 'available';
+    end if;
+
+    select coalesce(max(turn_index), 0)
+      into v_last
+      from public.messages
+     where session_id = p_session_id;
+
+    insert into public.messages (session_id, user_id, turn_index, role, content)
+    select p_session_id, p_user_id, v_last + e.ord::int, m.role, m.content
+      from jsonb_array_elements(p_messages) with ordinality as e(msg, ord)
+     cross join lateral jsonb_populate_record(null::public.messages, e.msg) as m;
+end;
+$$;
+
+revoke all on function public.chat_send_tx(uuid, uuid, boolean, jsonb, int) from public, anon, authenticated;
+grant execute on function public.chat_send_tx(uuid, uuid, boolean, jsonb, int) to service_role;
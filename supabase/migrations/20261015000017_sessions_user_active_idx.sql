@@ -0,0 +1,6 @@
+-- First open session of a user (app/services.py get_available_session):
+-- user_id = ? and status in ('in_progress', 'available') order by session_number limit 1
+
+create index if not exists sessions_user_active_idx
+    on public.sessions (user_id, session_number)
+    where status in ('in_progress', 'available');
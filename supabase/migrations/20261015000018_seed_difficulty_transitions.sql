@@ -0,0 +1,72 @@
+-- seed_sessions_for_user: build the difficulty chain from a fixed transition
+-- table (the two levels other than the previous one) instead of a per-step
+-- unnest + order by random() subquery. Same distribution: session 1 is L1,
+-- each following level is either of the other two with equal probability.
+
+create or replace function public.seed_sessions_for_user(p_user_id uuid)
+returns void
+language plpgsql
+as $$
+declare
+    v_picks int[];
+    v_prog public.student_program;
+    v_diffs text[] := array['L1'];
+    v_sn int;
+begin
+    if (select count(*) from public.sessions where user_id = p_user_id) >= 16 then
+        return;
+    end if;
+
+    select array_agg(n)
+      into v_picks
+      from (select n from generate_series(2, 16) as n order by random() limit 4) as t;
+
+    insert into public.student_program (user_id, reorientation_immediate_sessions, reorientation_delayed_sessions)
+    values (
+        p_user_id,
+        (select array_agg(x order by x) from unnest(v_picks[1:2]) as x),
+        (select array_agg(x order by x) from unnest(v_picks[3:4]) as x)
+    )
+    on conflict (user_id) do nothing;
+
+    select *
+      into v_prog
+      from public.student_program
+     where user_id = p_user_id;
+
+    for v_sn in 2..16 loop
+        v_diffs := v_diffs || (case v_diffs[v_sn - 1]
+            when 'L1' then array['L2', 'L3']
+            when 'L2' then array['L1', 'L3']
+            else array['L1', 'L2']
+        end)[1 + floor(random() * 2)::int];
+    end loop;
+
+    -- rows go through jsonb_populate_record so each value takes the column's type
+    insert into public.sessions (
+        user_id, session_number, status, difficulty, reorientation,
+        patient_age, patient_gender, patient_opening_starts
+    )
+    select r.user_id, r.session_number, r.status, r.difficulty, r.reorientation,
+           r.patient_age, r.patient_gender, r.patient_opening_starts
+      from generate_series(1, 16) as n
+     cross join lateral jsonb_populate_record(null::public.sessions, jsonb_build_object(
+            'user_id', p_user_id,
+            'session_number', n,
+            'status', case when n = 1 then 'available' else 'locked' end,
+            'difficulty', v_diffs[n],
+            'reorientation', case
+                when n = any(v_prog.reorientation_immediate_sessions) then 'immediate'
+                when n = any(v_prog.reorientation_delayed_sessions) then 'delayed'
+                else 'none'
+            end,
+            'patient_age', (array[12, 15, 18, 24, 32, 41, 52, 67, 74])[1 + floor(random() * 9)::int],
+            'patient_gender', (array['female', 'male'])[1 + floor(random() * 2)::int],
+            'patient_opening_starts', random() < 0.5
+         )) as r
+    on conflict (user_id, session_number) do nothing;
+end;
+$$;
+
+revoke all on function public.seed_sessions_for_user(uuid) from public, anon, authenticated;
+grant execute on function public.seed_sessions_for_user(uuid) to service_role;
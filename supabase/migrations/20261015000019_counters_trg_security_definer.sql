@@ -0,0 +1,11 @@
+-- counters has RLS on and no policies, so its trigger functions must not run
+-- as the role writing profiles / sessions: any non-service-role write would
+-- fail (or leave /admin/stats wrong). Run them as their owner instead.
+
+alter function public.counters_students_trg()
+    security definer
+    set search_path = public;
+
+alter function public.counters_sessions_completed_trg()
+    security definer
+    set search_path = public;
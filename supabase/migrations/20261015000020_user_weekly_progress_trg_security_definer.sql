@@ -0,0 +1,7 @@
+-- user_weekly_progress has RLS on and no policies, so its trigger function must
+-- not run as the role writing sessions: any non-service-role session write
+-- would abort on the insert. Run it as its owner instead.
+
+alter function public.user_weekly_progress_trg()
+    security definer
+    set search_path = public;
@@ -0,0 +1,30 @@
+-- ensure_profile runs on every authenticated request: only update the row when
+-- the email actually changes, so repeat logins don't write a new profiles row
+-- version (and WAL) each time. When nothing is written, the existing row is
+-- read back in a separate statement (fresh snapshot, so a row inserted by a
+-- concurrent first login is visible too).
+
+create or replace function public.ensure_profile(uid uuid, em text)
+returns public.profiles
+language plpgsql
+as $$
+declare
+    v_prof public.profiles;
+begin
+    insert into public.profiles (user_id, email, role, level, preferred_language)
+    values (uid, em, 'student', 'autre', 'fr')
+    on conflict (user_id) do update
+        set email = excluded.email
+        where excluded.email is not null
+          and public.profiles.email is distinct from excluded.email
+    returning * into v_prof;
+
+    if not found then
+        select * into v_prof from public.profiles where user_id = uid;
+    end if;
+    return v_prof;
+end;
+$$;
+
+revoke all on function public.ensure_profile(uuid, text) from public, anon, authenticated;
+grant execute on function public.ensure_profile(uuid, text) to service_role;